@@ -362,6 +362,42 @@ def proxy_options(parser):
         action="store", type=int, dest="port", default=8080,
         help="Proxy service port."
     )
+    group.add_argument(
+        "--thread-stack-size",
+        action="store", dest="thread_stack_size", default=None,
+        metavar="SIZE",
+        help="""
+            Stack size of the threads that handle client connections. Every
+            active connection is served by its own thread, so lowering this
+            considerably reduces the memory footprint of many concurrent
+            clients. Note that this applies to all threads that are started
+            afterwards, including replay and script threads. Understands
+            k/m/g suffixes, i.e. 256k for 256 kilobytes. Defaults to the
+            platform default.
+        """
+    )
+    group.add_argument(
+        "--event-loop",
+        action="store_true", dest="event_loop", default=False,
+        help="""
+            Hand idle keep-alive client connections over to a single event
+            loop thread instead of keeping a thread for each of them. Applies
+            to plain HTTP clients, TLS-intercepted connections keep their
+            thread. Idle server connections are released when their client
+            connection is parked.
+        """
+    )
+    group.add_argument(
+        "--upstream-pool-size",
+        action="store", type=int, dest="upstream_pool_size",
+        default=config.DEFAULT_POOL_SIZE, metavar="N",
+        help="""
+            Maximum number of idle keep-alive server connections that are kept
+            open to be reused by other client connections. Connections that
+            carried NTLM or Negotiate authentication are never reused.
+            Default: %(default)s (no reuse across client connections)
+        """
+    )
     http2 = group.add_mutually_exclusive_group()
     http2.add_argument("--http2", action="store_true", dest="http2")
     http2.add_argument("--no-http2", action="store_false", dest="http2",
@@ -394,6 +430,22 @@ def proxy_ssl_options(parser):
              'in the PEM, it is used, else the default key in the conf dir is used. '
              'The PEM file should contain the full certificate chain, with the leaf certificate '
              'as the first entry. Can be passed multiple times.')
+    group.add_argument(
+        "--cert-cache", default=False,
+        action="store_true", dest="cert_cache",
+        help="""
+            Keep generated interception certificates in the conf dir, so that
+            they do not have to be generated again after a restart.
+        """
+    )
+    group.add_argument(
+        "--cert-prewarm", default=None,
+        action="store", type=str, dest="cert_prewarm", metavar="PATH",
+        help="""
+            Generate interception certificates in the background on startup.
+            PATH is either a flow file or a file with one host[:port] per line.
+        """
+    )
     group.add_argument(
         "--ciphers-client", action="store",
         type=str, dest="ciphers_client", default=config.DEFAULT_CLIENT_CIPHERS,
@@ -445,6 +497,25 @@ def proxy_ssl_options(parser):
         help="Set supported SSL/TLS versions for server connections. "
              "SSLv2, SSLv3 and 'all' are INSECURE. Defaults to secure, which is TLS1.0+."
     )
+    group.add_argument(
+        "--upstream-tls-session-cache",
+        action="store", type=int, dest="tls_session_cache_size",
+        default=config.DEFAULT_CACHE_SIZE, metavar="N",
+        help="""
+            Maximum number of TLS sessions that are kept to resume handshakes
+            with upstream servers. 0 disables session resumption.
+            Default: %(default)s
+        """
+    )
+    group.add_argument(
+        "--upstream-tls-session-ttl",
+        action="store", type=int, dest="tls_session_cache_ttl",
+        default=config.DEFAULT_CACHE_TTL, metavar="SECONDS",
+        help="""
+            Time after which cached upstream TLS sessions are no longer
+            resumed. Default: %(default)s
+        """
+    )
 
 
 def onboarding_app(parser):
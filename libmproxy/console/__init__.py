@@ -205,6 +205,7 @@ class ConsoleMaster(flow.FlowMaster):
         self.refresh_server_playback = options.refresh_server_playback
         self.anticache = options.anticache
         self.anticomp = options.anticomp
+        self.invalidate_subscriptions()
         self.killextra = options.kill
         self.rheaders = options.rheaders
         self.nopop = options.nopop
@@ -460,7 +461,12 @@ class ConsoleMaster(flow.FlowMaster):
 
         self.server.start_slave(
             controller.Slave,
-            controller.Channel(self.masterq, self.should_exit)
+            controller.Channel(
+                self.masterq,
+                self.should_exit,
+                self.hook_stats,
+                self.subscribed
+            )
         )
 
         if self.options.rfile:
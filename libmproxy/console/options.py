@@ -169,9 +169,11 @@ class Options(urwid.WidgetWrap):
 
     def toggle_anticache(self):
         self.master.anticache = not self.master.anticache
+        self.master.invalidate_subscriptions()
 
     def toggle_anticomp(self):
         self.master.anticomp = not self.master.anticomp
+        self.master.invalidate_subscriptions()
 
     def toggle_killextra(self):
         self.master.killextra = not self.master.killextra
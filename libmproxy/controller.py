@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 import Queue
 import threading
+import time
+import weakref
 
 
 class DummyReply:
@@ -17,7 +19,7 @@ class DummyReply:
         self.acked = True
 
 
-class Reply:
+class Reply(object):
 
     """
         Messages sent through a channel are decorated with a "reply" attribute.
@@ -27,38 +29,125 @@ class Reply:
 
     def __init__(self, obj):
         self.obj = obj
-        self.q = Queue.Queue()
         self.acked = False
+        self.value = None
+        # A pre-acquired lock is the cheapest primitive to block on: unlike a
+        # Queue, it does not allocate three conditions per message, and a
+        # blocking acquire without timeout does not poll.
+        self._done = threading.Lock()
+        self._done.acquire()
+        # The master may abort a reply while the proxy thread aborts it as
+        # well, so acking must be atomic: _done can only be released once.
+        self._ack_lock = threading.Lock()
 
-    def __call__(self, msg=None):
-        if not self.acked:
+    def _ack(self, value):
+        with self._ack_lock:
+            if self.acked:
+                return
             self.acked = True
-            if msg is None:
-                self.q.put(self.obj)
-            else:
-                self.q.put(msg)
+            self.value = value
+            self._done.release()
+
+    def __call__(self, msg=None):
+        self._ack(self.obj if msg is None else msg)
+
+    def abort(self):
+        """
+            Wake up the waiting thread without a response, e.g. on shutdown.
+            Any later reply is ignored.
+        """
+        self._ack(None)
+
+    def wait(self):
+        """
+            Block until the message has been replied to or aborted and
+            return the response.
+        """
+        self._done.acquire()
+        return self.value
+
+
+class HookStats(object):
+
+    """
+        Round-trip latency counters for messages sent with Channel.ask, i.e.
+        the time a proxy thread spent waiting for the master, by message type.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.stats = {}
+
+    def add(self, mtype, duration):
+        with self._lock:
+            count, total, maximum = self.stats.get(mtype, (0, 0.0, 0.0))
+            self.stats[mtype] = (count + 1, total + duration, max(maximum, duration))
+
+    def get_state(self):
+        """
+            Returns a dict of message type -> dict(count, avg, max). Times are
+            in seconds.
+        """
+        with self._lock:
+            return {
+                mtype: dict(count=count, avg=total / count, max=maximum)
+                for mtype, (count, total, maximum) in self.stats.items()
+            }
+
+    def summary(self):
+        """
+            Returns a list of human-readable lines, slowest hook first.
+        """
+        state = self.get_state()
+        return [
+            "{}: {} calls, avg {:.2f}ms, max {:.2f}ms".format(
+                mtype, v["count"], v["avg"] * 1000, v["max"] * 1000
+            )
+            for mtype, v in sorted(state.items(), key=lambda x: -x[1]["avg"])
+        ]
 
 
 class Channel:
 
-    def __init__(self, q, should_exit):
+    def __init__(self, q, should_exit, stats=None, subscribed=None):
+        """
+            subscribed: An optional callable (mtype, message) -> bool. Messages
+            for which it returns False are not sent to the master at all.
+            Layers may pass None as message to find out whether they need to
+            create a message of that type in the first place.
+        """
         self.q = q
         self.should_exit = should_exit
+        self.stats = stats
+        self.subscribed = subscribed
 
     def ask(self, mtype, m):
         """
             Decorate a message with a reply attribute, and send it to the
             master.  then wait for a response.
         """
-        m.reply = Reply(m)
+        if self.should_exit.is_set():
+            return None
+        if self.subscribed and not self.subscribed(mtype, m):
+            # Nobody is interested: behave as if the master had acked the
+            # message without changing it.
+            m.reply = DummyReply()
+            return m
+        reply = m.reply = Reply(m)
+        start = time.time()
         self.q.put((mtype, m))
-        while not self.should_exit.is_set():
-            try:
-                # The timeout is here so we can handle a should_exit event.
-                g = m.reply.q.get(timeout=0.5)
-            except Queue.Empty:  # pragma: nocover
-                continue
-            return g
+        # The master sets should_exit before it aborts all pending replies.
+        # If we missed that, we must not wait for a reply that never comes.
+        if self.should_exit.is_set():
+            reply.abort()
+        g = reply.wait()
+        if self.stats is not None:
+            self.stats.add(mtype, time.time() - start)
+        return g
 
     def tell(self, mtype, m):
         """
@@ -66,6 +155,8 @@ class Channel:
             master, then return immediately.
         """
         m.reply = DummyReply()
+        if self.subscribed and not self.subscribed(mtype, m):
+            return
         self.q.put((mtype, m))
 
 
@@ -100,26 +191,39 @@ class Master(object):
         self.server = server
         self.masterq = Queue.Queue()
         self.should_exit = threading.Event()
+        self.hook_stats = HookStats()
+        # Replies of messages that have been handed to a handler, but may not
+        # have been acked yet (e.g. intercepted flows).
+        self._pending_replies = weakref.WeakSet()
 
     def tick(self, q, timeout):
-        changed = False
+        """
+            Wait up to timeout seconds for a message, then handle it together
+            with everything else that has been queued up in the meantime.
+        """
         try:
-            # This endless loop runs until the 'Queue.Empty'
-            # exception is thrown. If more than one request is in
-            # the queue, this speeds up every request by 0.1 seconds,
-            # because get_input(..) function is not blocking.
-            while True:
-                msg = q.get(timeout=timeout)
-                self.handle(*msg)
-                q.task_done()
-                changed = True
+            msg = q.get(timeout=timeout)
         except Queue.Empty:
-            pass
-        return changed
+            return False
+        while True:
+            self.handle(*msg)
+            q.task_done()
+            try:
+                msg = q.get_nowait()
+            except Queue.Empty:
+                return True
 
     def run(self):
         self.should_exit.clear()
-        self.server.start_slave(Slave, Channel(self.masterq, self.should_exit))
+        self.server.start_slave(
+            Slave,
+            Channel(
+                self.masterq,
+                self.should_exit,
+                self.hook_stats,
+                self.subscribed
+            )
+        )
         while not self.should_exit.is_set():
 
             # Don't choose a very small timeout in Python 2:
@@ -128,7 +232,18 @@ class Master(object):
             self.tick(self.masterq, 0.1)
         self.shutdown()
 
+    def subscribed(self, mtype, obj):
+        """
+            Returns True if a message needs to be handled on the master thread.
+            This is called on the proxy threads for every message, so it must
+            be cheap and must not modify any state.
+        """
+        return True
+
     def handle(self, mtype, obj):
+        reply = getattr(obj, "reply", None)
+        if isinstance(reply, Reply):
+            self._pending_replies.add(reply)
         c = "handle_" + mtype
         m = getattr(self, c, None)
         if m:
@@ -136,8 +251,25 @@ class Master(object):
         else:
             obj.reply()
 
+    def abort_pending(self):
+        """
+            Wake up all proxy threads that are still waiting for a reply.
+        """
+        while True:
+            try:
+                _, obj = self.masterq.get_nowait()
+            except Queue.Empty:
+                break
+            reply = getattr(obj, "reply", None)
+            if isinstance(reply, Reply):
+                reply.abort()
+            self.masterq.task_done()
+        for reply in list(self._pending_replies):
+            reply.abort()
+
     def shutdown(self):
         if not self.should_exit.is_set():
             self.should_exit.set()
+            self.abort_pending()
             if self.server:
                 self.server.shutdown()
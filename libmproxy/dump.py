@@ -58,11 +58,14 @@ class Options(object):
 class DumpMaster(flow.FlowMaster):
 
     def __init__(self, server, options, outfile=None):
+        # Needed by subscriptions(), which FlowMaster.__init__ already calls.
+        self.o = options
+        self._log_handler_overridden = "log" in self.overridden_handlers(DumpMaster)
         flow.FlowMaster.__init__(self, server, flow.State())
         self.outfile = outfile
-        self.o = options
         self.anticache = options.anticache
         self.anticomp = options.anticomp
+        self.invalidate_subscriptions()
         self.showhost = options.showhost
         self.replay_ignore_params = options.replay_ignore_params
         self.replay_ignore_content = options.replay_ignore_content
@@ -143,9 +146,27 @@ class DumpMaster(flow.FlowMaster):
         except flow.FlowReadError as e:
             raise DumpError(e.strerror)
 
-    def add_event(self, e, level="info"):
+    def _shows_event(self, level):
         needed = dict(error=0, info=1, debug=2).get(level, 1)
-        if self.o.verbosity >= needed:
+        return self.o.verbosity >= needed
+
+    def subscriptions(self):
+        subs = self.hook_subscriptions()
+        subs.update(self.overridden_handlers(DumpMaster))
+        subs.add("log")
+        # Flows are only kept in the state between the request and the
+        # response or error, so we need all of these or none.
+        if self.o.flow_detail or subs.intersection(("request", "response", "error")):
+            subs.update(("request", "response", "error"))
+        return subs
+
+    def subscribed(self, mtype, obj):
+        if mtype == "log" and not self._shows_event(obj.level):
+            return self._log_handler_overridden
+        return flow.FlowMaster.subscribed(self, mtype, obj)
+
+    def add_event(self, e, level="info"):
+        if self._shows_event(level):
             self.echo(
                 e,
                 fg="red" if level == "error" else None,
@@ -308,7 +329,9 @@ class DumpMaster(flow.FlowMaster):
             self.outfile.flush()
 
     def _process_flow(self, f):
-        self.state.delete_flow(f)
+        # The request may have been skipped if nobody was interested in it.
+        if f in self.state.flows:
+            self.state.delete_flow(f)
         if self.filt and not f.match(self.filt):
             return
 
@@ -334,6 +357,21 @@ class DumpMaster(flow.FlowMaster):
         return f
 
     def shutdown(self):  # pragma: no cover
+        for line in self.hook_stats.summary():
+            self.add_event("Hook latency: " + line, "debug")
+        if self.server:
+            self.add_event(
+                "TLS session cache: " + self.server.config.tls_session_cache.summary(),
+                "debug"
+            )
+            self.add_event(
+                "Client TLS context cache: " + self.server.config.client_tls_context_cache.summary(),
+                "debug"
+            )
+            self.add_event(
+                "Certificate store: " + self.server.config.certstore.summary(),
+                "debug"
+            )
         return flow.FlowMaster.shutdown(self)
 
     def run(self):  # pragma: no cover
@@ -20,6 +20,20 @@ from .protocol.http_replay import RequestReplayThread
 from .protocol import Kill
 from .models import ClientConnection, ServerConnection, HTTPResponse, HTTPFlow, HTTPRequest
 
+# Messages that inline scripts can hook into.
+SCRIPT_HOOKS = (
+    "clientconnect",
+    "clientdisconnect",
+    "serverconnect",
+    "serverdisconnect",
+    "next_layer",
+    "request",
+    "responseheaders",
+    "response",
+    "error",
+    "tcp_message",
+)
+
 
 class AppRegistry:
 
@@ -51,8 +65,17 @@ class AppRegistry:
 
 class ReplaceHooks:
 
-    def __init__(self):
+    def __init__(self, changed=None):
+        """
+            changed: An optional callable that is invoked whenever the
+            list of hooks is modified.
+        """
         self.lst = []
+        self.changed = changed
+
+    def _changed(self):
+        if self.changed:
+            self.changed()
 
     def set(self, r):
         self.clear()
@@ -78,6 +101,7 @@ class ReplaceHooks:
         except re.error:
             return False
         self.lst.append((fpatt, rex, s, cpatt))
+        self._changed()
         return True
 
     def get_specs(self):
@@ -100,12 +124,22 @@ class ReplaceHooks:
 
     def clear(self):
         self.lst = []
+        self._changed()
 
 
 class SetHeaders:
 
-    def __init__(self):
+    def __init__(self, changed=None):
+        """
+            changed: An optional callable that is invoked whenever the
+            list of hooks is modified.
+        """
         self.lst = []
+        self.changed = changed
+
+    def _changed(self):
+        if self.changed:
+            self.changed()
 
     def set(self, r):
         self.clear()
@@ -127,6 +161,7 @@ class SetHeaders:
         if not cpatt:
             return False
         self.lst.append((fpatt, header, value, cpatt))
+        self._changed()
         return True
 
     def get_specs(self):
@@ -141,6 +176,7 @@ class SetHeaders:
 
     def clear(self):
         self.lst = []
+        self._changed()
 
     def run(self, f):
         for _, header, value, cpatt in self.lst:
@@ -644,14 +680,16 @@ class FlowMaster(controller.Master):
         self.anticomp = False
         self.stream_large_bodies = False
         self.refresh_server_playback = False
-        self.replacehooks = ReplaceHooks()
-        self.setheaders = SetHeaders()
+        self.replacehooks = ReplaceHooks(self.invalidate_subscriptions)
+        self.setheaders = SetHeaders(self.invalidate_subscriptions)
         self.replay_ignore_params = False
         self.replay_ignore_content = None
         self.replay_ignore_host = False
 
         self.stream = None
         self.apps = AppRegistry()
+        self._subscriptions = frozenset()
+        self.invalidate_subscriptions()
 
     def start_app(self, host, port):
         self.apps.add(
@@ -676,6 +714,7 @@ class FlowMaster(controller.Master):
             self.add_event("Script error:\n" + str(e), "error")
         script.reloader.unwatch(script_obj)
         self.scripts.remove(script_obj)
+        self.invalidate_subscriptions()
 
     def load_script(self, command, use_reloader=True):
         """
@@ -689,6 +728,7 @@ class FlowMaster(controller.Master):
         except script.ScriptException as v:
             return v.args[0]
         self.scripts.append(s)
+        self.invalidate_subscriptions()
 
     def _run_single_script_hook(self, script_obj, name, *args, **kwargs):
         if script_obj and not self.pause_scripts:
@@ -701,6 +741,71 @@ class FlowMaster(controller.Master):
         for script_obj in self.scripts:
             self._run_single_script_hook(script_obj, name, *args, **kwargs)
 
+    def hook_subscriptions(self):
+        """
+            Returns the set of message types that loaded scripts and the
+            enabled flow processing features (replacements, sticky cookies,
+            playback, streaming, ...) need to see.
+        """
+        subs = set()
+        if not self.pause_scripts:
+            for script_obj in self.scripts:
+                ns = script_obj.ns
+                if ns:
+                    subs.update(h for h in SCRIPT_HOOKS if h in ns)
+        if self.replacehooks.lst or self.setheaders.lst or self.stickycookie_state:
+            subs.update(("request", "response"))
+        if self.stickyauth_state or self.anticache or self.anticomp or self.server_playback:
+            subs.add("request")
+        if self.stream_large_bodies:
+            subs.add("responseheaders")
+        if self.client_playback:
+            subs.update(("response", "error"))
+        if self.stream:
+            subs.add("response")
+        return subs
+
+    def overridden_handlers(self, base):
+        """
+            Returns the set of message types whose handler has been
+            overridden in a subclass of base. We have no idea what these do,
+            so they always need to be called.
+        """
+        return set(
+            mtype for mtype in SCRIPT_HOOKS + ("log",)
+            if getattr(getattr(self, "handle_" + mtype), "__func__", None) is not
+            getattr(base, "handle_" + mtype).__func__
+        )
+
+    def subscriptions(self):
+        """
+            Returns the set of message types that need to be handled on the
+            master thread with the current configuration. All flows are kept
+            in the state, so the flow events are always included.
+        """
+        subs = self.hook_subscriptions()
+        subs.update(self.overridden_handlers(FlowMaster))
+        subs.update(("log", "request", "response", "error"))
+        return subs
+
+    def invalidate_subscriptions(self):
+        """
+            Recomputes the cached set of subscribed message types. Needs to
+            be called whenever something changes that subscriptions() depends
+            on, e.g. the loaded scripts or the enabled flow processing
+            features.
+        """
+        self._subscriptions = frozenset(self.subscriptions())
+
+    def subscribed(self, mtype, obj):
+        """
+            Called from the proxy threads for every message, so this must be
+            cheap: we only look at the set cached by invalidate_subscriptions().
+        """
+        if mtype == "request" and self.apps.get(obj.request):
+            return True
+        return mtype in self._subscriptions
+
     def get_ignore_filter(self):
         return self.server.config.check_ignore.patterns
 
@@ -723,12 +828,14 @@ class FlowMaster(controller.Master):
         else:
             self.stickycookie_state = None
             self.stickycookie_txt = None
+        self.invalidate_subscriptions()
 
     def set_stream_large_bodies(self, max_size):
         if max_size is not None:
             self.stream_large_bodies = StreamLargeBodies(max_size)
         else:
             self.stream_large_bodies = False
+        self.invalidate_subscriptions()
 
     def set_stickyauth(self, txt):
         if txt:
@@ -740,15 +847,18 @@ class FlowMaster(controller.Master):
         else:
             self.stickyauth_state = None
             self.stickyauth_txt = None
+        self.invalidate_subscriptions()
 
     def start_client_playback(self, flows, exit):
         """
             flows: List of flows.
         """
         self.client_playback = ClientPlaybackState(flows, exit)
+        self.invalidate_subscriptions()
 
     def stop_client_playback(self):
         self.client_playback = None
+        self.invalidate_subscriptions()
 
     def start_server_playback(
             self,
@@ -779,11 +889,13 @@ class FlowMaster(controller.Master):
             ignore_payload_params,
             ignore_host)
         self.kill_nonreplay = kill
+        self.invalidate_subscriptions()
 
     def stop_server_playback(self):
         if self.server_playback.exit:
             self.shutdown()
         self.server_playback = None
+        self.invalidate_subscriptions()
 
     def do_server_playback(self, flow):
         """
@@ -815,7 +927,7 @@ class FlowMaster(controller.Master):
                 self.shutdown()
             self.client_playback.tick(self)
             if self.client_playback.done():
-                self.client_playback = None
+                self.stop_client_playback()
 
         return super(FlowMaster, self).tick(q, timeout)
 
@@ -1059,6 +1171,7 @@ class FlowMaster(controller.Master):
             self.add_event('Error reloading "{}": {}'.format(s.filename, str(e)), 'error')
         else:
             self.add_event('"{}" reloaded.'.format(s.filename), 'info')
+        self.invalidate_subscriptions()
         return ok
 
     def handle_tcp_message(self, m):
@@ -1076,10 +1189,12 @@ class FlowMaster(controller.Master):
 
     def start_stream(self, fp, filt):
         self.stream = FilteredFlowWriter(fp, filt)
+        self.invalidate_subscriptions()
 
     def stop_stream(self):
         self.stream.fo.close()
         self.stream = None
+        self.invalidate_subscriptions()
 
     def start_stream_to_path(self, path, mode="wb"):
         path = os.path.expanduser(path)
@@ -2,12 +2,93 @@ from __future__ import (absolute_import, print_function, division)
 
 import copy
 import os
+import select
+
+import OpenSSL
+from OpenSSL import SSL
 
 from netlib import tcp, certutils
+from netlib.exceptions import TlsException
 from .. import stateobject, utils
 
 
-class ClientConnection(tcp.BaseHandler, stateobject.StateObject):
+def _tls_session_resumption_supported():
+    lib = getattr(getattr(OpenSSL, "_util", None), "lib", None)
+    return (
+        hasattr(SSL.Connection, "set_session") and
+        hasattr(SSL.Connection, "get_session") and
+        hasattr(lib, "SSL_session_reused")
+    )
+
+# Whether pyOpenSSL lets us resume TLS sessions with upstream servers, see TlsSessionResumption.
+TLS_SESSION_RESUMPTION = _tls_session_resumption_supported()
+
+
+class TlsSessionResumption(object):
+
+    """
+    Lets a :py:class:`netlib.tcp.TCPClient` resume a previous TLS session, and tells netlib
+    connections on both sides whether their handshake resumed a session.
+
+    This is the only place that relies on netlib and pyOpenSSL internals for that:
+
+    - netlib's convert_to_ssl() creates the SSL.Connection and starts the handshake right away,
+      so the session is offered when that SSL.Connection is assigned to ``connection``.
+    - pyOpenSSL does not expose SSL_session_reused(), so we call it via its private bindings.
+
+    If either is not available (see ``TLS_SESSION_RESUMPTION``), no session is ever offered or
+    returned and every handshake is a full one.
+    """
+
+    _resume_session = None
+    _connection = None
+
+    @property
+    def connection(self):
+        return self._connection
+
+    @connection.setter
+    def connection(self, conn):
+        session, self._resume_session = self._resume_session, None
+        if session is not None and isinstance(conn, SSL.Connection):
+            try:
+                conn.set_session(session)
+            except SSL.Error:
+                pass
+        self._connection = conn
+
+    def convert_to_ssl_resuming(self, session, **kwargs):
+        """
+        Like convert_to_ssl(), but tries to resume the given session (if not None).
+        """
+        if TLS_SESSION_RESUMPTION:
+            self._resume_session = session
+        try:
+            self.convert_to_ssl(**kwargs)
+        finally:
+            self._resume_session = None
+
+    def tls_session_reused(self):
+        """
+        Returns True if the TLS handshake resumed a session.
+        """
+        if not TLS_SESSION_RESUMPTION:
+            return False
+        return bool(OpenSSL._util.lib.SSL_session_reused(self.connection._ssl))
+
+    def get_tls_session(self):
+        """
+        Returns the current TLS session, which can be resumed by other connections, or None.
+        """
+        if not TLS_SESSION_RESUMPTION:
+            return None
+        try:
+            return self.connection.get_session()
+        except SSL.Error:
+            return None
+
+
+class ClientConnection(TlsSessionResumption, tcp.BaseHandler, stateobject.StateObject):
 
     def __init__(self, client_connection, address, server):
         # Eventually, this object is restored from state. We don't have a
@@ -79,16 +160,64 @@ class ClientConnection(tcp.BaseHandler, stateobject.StateObject):
         f.load_state(state)
         return f
 
+    def has_buffered_data(self):
+        """
+        Returns True if data from the client has already been read into our buffer.
+        Such data will not make the socket readable anymore.
+        """
+        buf = getattr(self.rfile.o, "_rbuf", None)
+        if buf is None:
+            # Not a socket._fileobject, we cannot tell.
+            return True
+        return bool(buf.getvalue())
+
+    def wait_for_data(self, timeout):
+        """
+        Waits for up to timeout seconds until the client sends data or closes the connection.
+        Only works for connections without TLS.
+
+        Returns:
+            False, if the connection has been idle for the whole time.
+        """
+        if self.has_buffered_data():
+            return True
+        if hasattr(select, "poll"):
+            # select.select() cannot handle file descriptors above FD_SETSIZE,
+            # which we easily exceed with many idle connections.
+            poller = select.poll()
+            poller.register(self.connection.fileno(), select.POLLIN | select.POLLPRI)
+            return bool(poller.poll(timeout * 1000))
+        return bool(select.select([self.connection], [], [], timeout)[0])  # pragma: no cover
+
+    def create_ssl_context(self, cert, key, context_cache=None, **sslctx_kwargs):
+        """
+        Args:
+            context_cache: An optional :py:class:`libmproxy.proxy.session_cache.TlsContextCache`
+                to share the context with other client connections, which allows clients to
+                resume their sessions.
+        """
+        def create():
+            return super(ClientConnection, self).create_ssl_context(cert, key, **sslctx_kwargs)
+        if context_cache is None:
+            return create()
+        cache_key = (
+            cert.digest("sha256") if isinstance(cert, certutils.SSLCert) else cert,
+            tuple(sorted(sslctx_kwargs.items()))
+        )
+        return context_cache.get(cache_key, create)
+
     def convert_to_ssl(self, *args, **kwargs):
         super(ClientConnection, self).convert_to_ssl(*args, **kwargs)
         self.timestamp_ssl_setup = utils.timestamp()
+        if kwargs.get("context_cache") is not None:
+            kwargs["context_cache"].handshake_done(self)
 
     def finish(self):
         super(ClientConnection, self).finish()
         self.timestamp_end = utils.timestamp()
 
 
-class ServerConnection(tcp.TCPClient, stateobject.StateObject):
+class ServerConnection(TlsSessionResumption, tcp.TCPClient, stateobject.StateObject):
 
     def __init__(self, address, source_address=None):
         tcp.TCPClient.__init__(self, address, source_address)
@@ -99,6 +228,15 @@ class ServerConnection(tcp.TCPClient, stateobject.StateObject):
         self.timestamp_tcp_setup = None
         self.timestamp_ssl_setup = None
         self.protocol = None
+        # Set after a complete HTTP/1 exchange if the connection can be reused.
+        self.keep_alive = False
+        # Set once NTLM or Negotiate authentication has been used on the connection.
+        # The server then authenticates the connection rather than single requests.
+        self.connection_auth = False
+        self.session_cache = None
+        self._clientcert = None
+        self.alpn_protos = None
+        self.clientcerts = None
 
     def __nonzero__(self):
         return bool(self.connection) and not self.finished
@@ -173,7 +311,12 @@ class ServerConnection(tcp.TCPClient, stateobject.StateObject):
         self.wfile.write(message)
         self.wfile.flush()
 
-    def establish_ssl(self, clientcerts, sni, **kwargs):
+    def establish_ssl(self, clientcerts, sni, session_cache=None, **kwargs):
+        """
+        Args:
+            session_cache: An optional :py:class:`libmproxy.proxy.session_cache.TlsSessionCache`
+                to resume previous sessions with the same server from.
+        """
         clientcert = None
         if clientcerts:
             if os.path.isfile(clientcerts):
@@ -185,11 +328,35 @@ class ServerConnection(tcp.TCPClient, stateobject.StateObject):
                 if os.path.exists(path):
                     clientcert = path
 
-        self.convert_to_ssl(cert=clientcert, sni=sni, **kwargs)
+        cached = None
+        if session_cache is not None:
+            cached = session_cache.get(self.address, sni, clientcert)
+            verify = kwargs.get("verify_options", SSL.VERIFY_NONE) != SSL.VERIFY_NONE
+            if cached and cached.verification_error and verify:
+                # A resumed handshake would skip the now mandatory certificate verification.
+                cached = None
+        try:
+            self.convert_to_ssl_resuming(
+                cached.session if cached else None,
+                cert=clientcert, sni=sni, **kwargs
+            )
+        except TlsException:
+            if session_cache is not None:
+                session_cache.discard(self.address, sni, clientcert)
+            raise
         self.sni = sni
+        self.alpn_protos = kwargs.get("alpn_protos")
+        self.clientcerts = clientcerts
         self.timestamp_ssl_setup = utils.timestamp()
+        if session_cache is not None:
+            self.session_cache = session_cache
+            self._clientcert = clientcert
+            session_cache.handshake_done(self, clientcert, cached)
 
     def finish(self):
+        if self.session_cache is not None and self.ssl_established and not self.finished:
+            # With TLS 1.3, session tickets only arrive after the handshake.
+            self.session_cache.store(self, self._clientcert)
         tcp.TCPClient.finish(self)
         self.timestamp_end = utils.timestamp()
 
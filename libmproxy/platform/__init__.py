@@ -1,10 +1,14 @@
 import sys
 
 resolver = None
+# Moves data between two plain sockets within the kernel, if the platform supports it.
+splicer = None
 
 if sys.platform == "linux2":
     from . import linux
     resolver = linux.Resolver
+    if linux.SPLICE:
+        splicer = linux.Splicer
 elif sys.platform == "darwin":
     from . import osx
     resolver = osx.Resolver
@@ -1,9 +1,18 @@
+import ctypes
+import errno
+import fcntl
+import os
+import select
 import socket
 import struct
 
 # Python socket module does not have this constant
 SO_ORIGINAL_DST = 80
 
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+F_SETPIPE_SZ = 1031
+
 
 class Resolver(object):
 
@@ -12,3 +21,79 @@ class Resolver(object):
         _, port, a1, a2, a3, a4 = struct.unpack("!HHBBBBxxxxxxxx", odestdata)
         address = "%d.%d.%d.%d" % (a1, a2, a3, a4)
         return address, port
+
+
+def _load_splice():
+    try:
+        f = ctypes.CDLL(None, use_errno=True).splice
+    except (OSError, AttributeError):  # pragma: no cover
+        return None
+    f.argtypes = [
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint
+    ]
+    f.restype = ctypes.c_ssize_t
+    return f
+
+_splice = _load_splice()
+
+# Whether the C library provides splice(), see Splicer.
+SPLICE = _splice is not None
+
+
+class Splicer(object):
+
+    """
+    Moves data between two sockets with splice(), i.e. without copying it into user space.
+    splice() needs a pipe on one end, so data goes from the source socket into a pipe and from
+    there into the destination socket.
+    """
+
+    # The capacity we ask for the pipe. We never move more than fits into the pipe at once,
+    # so that filling it never blocks.
+    pipe_size = 1024 * 1024
+
+    def __init__(self):
+        self.pipe_r, self.pipe_w = os.pipe()
+        try:
+            self.chunk_size = fcntl.fcntl(self.pipe_w, F_SETPIPE_SZ, self.pipe_size)
+        except IOError:
+            # Limited by /proc/sys/fs/pipe-max-size, keep the default size.
+            self.chunk_size = 65536
+
+    def _splice(self, fd_in, fd_out, size):
+        while True:
+            n = _splice(fd_in, None, fd_out, None, size, SPLICE_F_MOVE | SPLICE_F_NONBLOCK)
+            if n >= 0:
+                return n
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err == errno.EAGAIN:
+                return None
+            raise socket.error(err, os.strerror(err))
+
+    def transfer(self, src, dst):
+        """
+        Moves the data that is available on the src socket to the dst socket.
+        Blocks until everything has been written.
+
+        Returns:
+            The number of bytes transferred, 0 if src has been closed,
+            or None if there was nothing to read after all.
+        """
+        size = self._splice(src.fileno(), self.pipe_w, self.chunk_size)
+        if size is None:
+            return None
+        pending = size
+        while pending:
+            n = self._splice(self.pipe_r, dst.fileno(), pending)
+            if n is None:
+                select.select([], [dst], [])
+            else:
+                pending -= n
+        return size
+
+    def close(self):
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
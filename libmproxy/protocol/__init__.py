@@ -26,15 +26,16 @@ as late as possible; this makes server replay without any outgoing connections p
 """
 
 from __future__ import (absolute_import, print_function, division)
-from .base import Layer, ServerConnectionMixin, Kill
-from .http import Http1Layer, UpstreamConnectLayer, Http2Layer
+from .base import Layer, ServerConnectionMixin, Kill, Park
+from .http import Http1Layer, UpstreamConnectLayer
+from .http2 import Http2Layer
 from .tls import TlsLayer
 from .tls import is_tls_record_magic
 from .tls import TlsClientHello
 from .rawtcp import RawTCPLayer
 
 __all__ = [
-    "Layer", "ServerConnectionMixin", "Kill",
+    "Layer", "ServerConnectionMixin", "Kill", "Park",
     "Http1Layer", "UpstreamConnectLayer", "Http2Layer",
     "TlsLayer", "is_tls_record_magic", "TlsClientHello",
     "RawTCPLayer",
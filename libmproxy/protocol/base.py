@@ -155,26 +155,46 @@ class ServerConnectionMixin(object):
     def disconnect(self):
         """
         Deletes (and closes) an existing server connection.
+        Idle keep-alive connections are handed over to the connection pool instead.
         Must not be called if there is no existing connection.
         """
         self.log("serverdisconnect", "debug", [repr(self.server_conn.address)])
         address = self.server_conn.address
         source_address = self.server_conn.source_address
-        self.server_conn.finish()
-        self.server_conn.close()
+        # Tell the master before the connection may be handed out to another client connection.
         self.channel.tell("serverdisconnect", self.server_conn)
+        if not self.config.connection_pool.put(self.server_conn):
+            self.server_conn.finish()
+            self.server_conn.close()
         self.server_conn = ServerConnection(address, source_address)
 
-    def connect(self):
+    def connect(self, reuse_tls=None):
         """
-        Establishes a server connection.
+        Establishes a server connection, or takes an idle one from the connection pool.
         Must not be called if there is an existing connection.
 
+        Args:
+            reuse_tls: ``(sni, alpn_protos)`` if the caller is going to establish TLS with these
+                parameters. A matching TLS connection from the pool may then be used, in which
+                case no handshake is necessary anymore.
+
         Raises:
             ~libmproxy.exceptions.ProtocolException: if the connection could not be established.
         """
         if not self.server_conn.address:
             raise ProtocolException("Cannot connect to server, no server address given.")
+        if reuse_tls:
+            sni, alpn_protos = reuse_tls
+            pooled = self.config.connection_pool.get(
+                self.server_conn.address, True, sni, alpn_protos, self.config.clientcerts
+            )
+        else:
+            pooled = self.config.connection_pool.get(self.server_conn.address)
+        if pooled:
+            self.log("serverconnect (reused)", "debug", [repr(pooled.address)])
+            self.server_conn = pooled
+            self.channel.ask("serverconnect", self.server_conn)
+            return
         self.log("serverconnect", "debug", [repr(self.server_conn.address)])
         self.channel.ask("serverconnect", self.server_conn)
         try:
@@ -196,3 +216,11 @@ class Kill(Exception):
     """
     Signal that both client and server connection(s) should be killed immediately.
     """
+
+
+class Park(Exception):
+
+    """
+    Signal that the client connection is idle and should be handed over to the proxy server's
+    event loop until the client sends more data. A new root layer then takes over.
+    """
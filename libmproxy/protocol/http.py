@@ -9,14 +9,52 @@ from netlib.exceptions import HttpException, HttpReadDisconnect, NetlibException
 from netlib.http import http1, Headers
 from netlib.http import CONTENT_MISSING
 from netlib.tcp import Address
-from netlib.http.http2.connections import HTTP2Protocol
-from netlib.http.http2.frame import GoAwayFrame, PriorityFrame, WindowUpdateFrame
 from .. import utils
-from ..exceptions import HttpProtocolException, ProtocolException
+from ..exceptions import HttpProtocolException, Http2ProtocolException, ProtocolException
 from ..models import (
     HTTPFlow, HTTPRequest, HTTPResponse, make_error_response, make_connect_response, Error, expect_continue_response
 )
-from .base import Layer, Kill
+from .base import Layer, Kill, Park
+from .tls import TlsLayer
+
+# In event loop mode, client connections that have been idle for this long (in seconds) are parked.
+PARK_DELAY = 1
+
+
+# Authentication schemes that authenticate the connection rather than the request.
+CONNECTION_AUTH_SCHEMES = ("ntlm", "negotiate")
+
+
+def connection_auth(request, response):
+    """
+    Returns True if the exchange carried connection-based authentication (NTLM, Negotiate).
+    """
+    values = (
+        request.headers.get_all("authorization") +
+        request.headers.get_all("proxy-authorization") +
+        response.headers.get_all("www-authenticate") +
+        response.headers.get_all("proxy-authenticate")
+    )
+    return any(
+        v.split(None, 1)[0].lower() in CONNECTION_AUTH_SCHEMES
+        for v in values if v.strip()
+    )
+
+
+def server_keep_alive(request, response):
+    """
+    Returns True if an HTTP/1 server connection is idle and can be reused
+    once the response to request has been read completely.
+    """
+    if request.form_in == "authority" or response.status_code == 101:
+        # The connection has been turned into a tunnel.
+        return False
+    return not (
+        connection_auth(request, response) or
+        http1.connection_close(request.http_version, request.headers) or
+        http1.connection_close(response.http_version, response.headers) or
+        http1.expected_http_body_size(request, response) == -1
+    )
 
 
 class _HttpLayer(Layer):
@@ -40,6 +78,12 @@ class _HttpLayer(Layer):
     def check_close_connection(self, flow):
         raise NotImplementedError()
 
+    def check_server_keep_alive(self, flow):
+        """
+        Returns True if the server connection can be reused for another request after this flow.
+        """
+        return False
+
 
 class _StreamingHttpLayer(_HttpLayer):
     supports_streaming = True
@@ -126,109 +170,13 @@ class Http1Layer(_StreamingHttpLayer):
             return False
         return close_connection
 
-    def __call__(self):
-        layer = HttpLayer(self, self.mode)
-        layer()
-
-
-# TODO: The HTTP2 layer is missing multiplexing, which requires a major rewrite.
-class Http2Layer(_HttpLayer):
-
-    def __init__(self, ctx, mode):
-        super(Http2Layer, self).__init__(ctx)
-        self.mode = mode
-        self.client_protocol = HTTP2Protocol(self.client_conn, is_server=True,
-                                             unhandled_frame_cb=self.handle_unexpected_frame_from_client)
-        self.server_protocol = HTTP2Protocol(self.server_conn, is_server=False,
-                                             unhandled_frame_cb=self.handle_unexpected_frame_from_server)
-
-    def read_request(self):
-        request = HTTPRequest.from_protocol(
-            self.client_protocol,
-            body_size_limit=self.config.body_size_limit
-        )
-        self._stream_id = request.stream_id
-        return request
-
-    def send_request(self, message):
-        # TODO: implement flow control and WINDOW_UPDATE frames
-        self.server_conn.send(self.server_protocol.assemble(message))
-
-    def read_response(self, request):
-        return HTTPResponse.from_protocol(
-            self.server_protocol,
-            request_method=request.method,
-            body_size_limit=self.config.body_size_limit,
-            include_body=True,
-            stream_id=self._stream_id
-        )
-
-    def send_response(self, message):
-        # TODO: implement flow control to prevent client buffer filling up
-        # maintain a send buffer size, and read WindowUpdateFrames from client to increase the send buffer
-        self.client_conn.send(self.client_protocol.assemble(message))
-
-    def check_close_connection(self, flow):
-        # TODO: add a timer to disconnect after a 10 second timeout
-        return False
-
-    def connect(self):
-        self.ctx.connect()
-        self.server_protocol = HTTP2Protocol(self.server_conn, is_server=False,
-                                             unhandled_frame_cb=self.handle_unexpected_frame_from_server)
-        self.server_protocol.perform_connection_preface()
-
-    def set_server(self, *args, **kwargs):
-        self.ctx.set_server(*args, **kwargs)
-        self.server_protocol = HTTP2Protocol(self.server_conn, is_server=False,
-                                             unhandled_frame_cb=self.handle_unexpected_frame_from_server)
-        self.server_protocol.perform_connection_preface()
+    def check_server_keep_alive(self, flow):
+        return server_keep_alive(flow.request, flow.response)
 
     def __call__(self):
-        self.server_protocol.perform_connection_preface()
         layer = HttpLayer(self, self.mode)
         layer()
 
-        # terminate the connection
-        self.client_conn.send(GoAwayFrame().to_bytes())
-
-    def handle_unexpected_frame_from_client(self, frame):
-        if isinstance(frame, WindowUpdateFrame):
-            # Clients are sending WindowUpdate frames depending on their flow control algorithm.
-            # Since we cannot predict these frames, and we do not need to respond to them,
-            # simply accept them, and hide them from the log.
-            # Ideally we should keep track of our own flow control window and
-            # stall transmission if the outgoing flow control buffer is full.
-            return
-        if isinstance(frame, PriorityFrame):
-            # Clients are sending Priority frames depending on their implementation.
-            # The RFC does not clearly state when or which priority preferences should be set.
-            # Since we cannot predict these frames, and we do not need to respond to them,
-            # simply accept them, and hide them from the log.
-            # Ideally we should forward them to the server.
-            return
-        if isinstance(frame, GoAwayFrame):
-            # Client wants to terminate the connection,
-            # relay it to the server.
-            self.server_conn.send(frame.to_bytes())
-            return
-        self.log("Unexpected HTTP2 frame from client: %s" % frame.human_readable(), "info")
-
-    def handle_unexpected_frame_from_server(self, frame):
-        if isinstance(frame, WindowUpdateFrame):
-            # Servers are sending WindowUpdate frames depending on their flow control algorithm.
-            # Since we cannot predict these frames, and we do not need to respond to them,
-            # simply accept them, and hide them from the log.
-            # Ideally we should keep track of our own flow control window and
-            # stall transmission if the outgoing flow control buffer is full.
-            return
-        if isinstance(frame, GoAwayFrame):
-            # Server wants to terminate the connection,
-            # relay it to the client.
-            self.client_conn.send(frame.to_bytes())
-            return
-        self.log("Unexpected HTTP2 frame from server: %s" % frame.human_readable(), "info")
-
 
 class ConnectServerConnection(object):
 
@@ -271,7 +219,9 @@ class UpstreamConnectLayer(Layer):
         if resp.status_code != 200:
             raise ProtocolException("Reconnect: Upstream server refuses CONNECT request")
 
-    def connect(self):
+    def connect(self, reuse_tls=None):
+        # TLS is established inside of the tunnel, so we can only reuse a plain
+        # connection to the upstream proxy here.
         if not self.server_conn:
             self.ctx.connect()
             self._send_connect_request()
@@ -308,8 +258,11 @@ class HttpLayer(Layer):
     def __call__(self):
         if self.mode == "transparent":
             self.__original_server_conn = self.server_conn
+        may_park = self.may_park()
         while True:
             try:
+                if may_park and not self.client_conn.wait_for_data(PARK_DELAY):
+                    raise Park()
                 request = self.get_request_from_client()
                 self.log("request", "debug", [repr(request)])
 
@@ -341,7 +294,8 @@ class HttpLayer(Layer):
                 flow.request = request
                 self.process_request_hook(flow)
 
-                if not flow.response:
+                from_server = not flow.response
+                if from_server:
                     self.establish_server_connection(flow)
                     self.get_response_from_server(flow)
                 else:
@@ -356,6 +310,11 @@ class HttpLayer(Layer):
                 if flow == Kill:
                     raise Kill()
                 self.send_response_to_client(flow)
+                if from_server:
+                    # Now that the response body has been read, the connection is idle again.
+                    if connection_auth(flow.request, flow.response):
+                        self.server_conn.connection_auth = True
+                    self.server_conn.keep_alive = self.check_server_keep_alive(flow)
 
                 if self.check_close_connection(flow):
                     return
@@ -387,6 +346,22 @@ class HttpLayer(Layer):
             finally:
                 flow.live = False
 
+    def may_park(self):
+        """
+        In event loop mode, an idle client connection can be parked between two requests if a new
+        root layer is able to take over. This is the case for plain HTTP/1 directly on top of a
+        resumable proxy mode.
+        """
+        if not self.config.event_loop or self.client_conn.tls_established:
+            return False
+        layers = self.layers
+        return (
+            len(layers) == 4 and
+            isinstance(layers[1], Http1Layer) and
+            isinstance(layers[2], TlsLayer) and
+            getattr(layers[3], "resumable", False)
+        )
+
     def get_request_from_client(self):
         request = self.read_request()
         if request.headers.get("expect", "").lower() == "100-continue":
@@ -400,7 +375,7 @@ class HttpLayer(Layer):
         try:
             response = make_error_response(code, message)
             self.send_response(response)
-        except NetlibException:
+        except (NetlibException, Http2ProtocolException):
             pass
 
     def change_upstream_proxy_server(self, address):
@@ -439,6 +414,8 @@ class HttpLayer(Layer):
             flow.response.timestamp_end = utils.timestamp()
 
     def get_response_from_server(self, flow):
+        self.server_conn.keep_alive = False
+
         def get_response():
             self.send_request(flow.request)
             if self.supports_streaming:
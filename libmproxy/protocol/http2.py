@@ -0,0 +1,811 @@
+from __future__ import (absolute_import, print_function, division)
+import os
+import struct
+import threading
+import traceback
+
+from hpack.hpack import Encoder, Decoder
+from six.moves import queue
+
+from netlib import tcp
+from netlib.exceptions import HttpException, NetlibException, TcpDisconnect
+from netlib.http import Headers, CONTENT_MISSING
+from netlib.http.http2 import frame
+from netlib.http.http2.frame import (
+    Frame, DataFrame, HeadersFrame, ContinuationFrame, PriorityFrame, RstStreamFrame,
+    SettingsFrame, PushPromiseFrame, PingFrame, GoAwayFrame, WindowUpdateFrame
+)
+from .. import utils
+from ..exceptions import Http2ProtocolException, ProtocolException
+from ..models import HTTPRequest, HTTPResponse
+from .base import Layer, Kill
+from .http import _StreamingHttpLayer, HttpLayer
+
+# Number of concurrent streams we allow the client to open.
+MAX_CONCURRENT_STREAMS = 100
+
+# We never announce a larger frame size, and the peer has to accept frames of this size.
+MAX_FRAME_SIZE = 2 ** 14
+DEFAULT_WINDOW_SIZE = 2 ** 16 - 1
+
+ERROR_CODES = frame.ERROR_CODES
+
+# Headers that are specific to an HTTP/1 connection and must not be sent over HTTP/2.
+CONNECTION_SPECIFIC_HEADERS = ("connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade")
+
+_VALID_FLAGS = {
+    cls.TYPE: sum(cls.VALID_FLAGS)
+    for cls in frame.FRAMES.values()
+}
+
+
+def _h2_headers(pseudo_headers, headers):
+    """
+    Returns the header fields that are sent over HTTP/2: the given pseudo headers first,
+    then all regular headers in lowercase, without connection-specific ones.
+    """
+    fields = list(pseudo_headers)
+    for name, value in headers.fields:
+        name = name.lower()
+        if name.startswith(b":") or name in CONNECTION_SPECIFIC_HEADERS:
+            continue
+        if name == b"te" and value.lower() != b"trailers":
+            continue
+        fields.append((name, value))
+    return fields
+
+
+class Http2Connection(object):
+
+    """
+    One side of a proxied HTTP/2 connection, i.e. either the client or the server connection.
+
+    Frames are read by the :py:class:`Http2Layer` only, but sent by all stream threads. Every
+    access to the underlying connection therefore holds the connection's lock. This also keeps
+    the HPACK encoder in sync with the order in which header blocks go over the wire.
+
+    We keep track of the peer's flow-control windows and never send more DATA than it allows.
+    Received data is acknowledged on the connection level right away, and on the stream level
+    once the stream has consumed it, so that a slow stream does not block the others.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        # netlib's frames expect these attributes on their state object.
+        self.http2_settings = frame.HTTP2_DEFAULT_SETTINGS.copy()
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.streams = {}  # stream id -> Http2SingleStreamLayer
+        self.windows = {}  # stream id -> send window
+        self.window = DEFAULT_WINDOW_SIZE
+        self.initial_window_size = DEFAULT_WINDOW_SIZE
+        self.max_concurrent_streams = None
+        self.next_stream_id = 1
+        self.goaway = False
+        self.closed = False
+
+    def has_buffered_data(self):
+        """
+        Returns True if data has already been read into our buffer,
+        which does not make the connection readable anymore.
+        """
+        buf = getattr(self.conn.rfile.o, "_rbuf", None)
+        return bool(buf and buf.getvalue())
+
+    def read_frame(self):
+        """
+        Reads the next frame. Must only be called if the connection is readable.
+
+        Returns:
+            The frame, or None for frames of unknown type, which must be ignored.
+        """
+        with self.lock:
+            raw_header = self.conn.rfile.safe_read(9)
+            length_high, length_low, typ, flags, stream_id = struct.unpack("!HBBBL", raw_header)
+            length = (length_high << 8) + length_low
+            if length > MAX_FRAME_SIZE:
+                raise Http2ProtocolException(
+                    "Frame size exceeded: %d, but only %d allowed." % (length, MAX_FRAME_SIZE)
+                )
+            payload = self.conn.rfile.safe_read(length)
+        if typ not in frame.FRAMES:
+            return None
+        # Unknown flags must be ignored as well.
+        flags &= _VALID_FLAGS[typ]
+        try:
+            return frame.FRAMES[typ].from_bytes(self, length, flags, stream_id & 0x7FFFFFFF, payload)
+        except (struct.error, IndexError) as e:
+            raise Http2ProtocolException("Invalid %s: %s" % (frame.FRAMES[typ].__name__, repr(e)))
+
+    def send_frame(self, *frames):
+        with self.lock:
+            if self.closed:
+                raise TcpDisconnect("HTTP/2 connection closed.")
+            self.conn.wfile.write(b"".join(frm.to_bytes() for frm in frames))
+            self.conn.wfile.flush()
+
+    def decode_headers(self, header_block):
+        return Headers([
+            [name.encode("utf-8"), value.encode("utf-8")]
+            for name, value in self.decoder.decode(header_block)
+        ])
+
+    def _headers_frames(self, stream_id, fields, end_stream, priority):
+        header_block = self.encoder.encode(fields)
+        chunks = [
+            header_block[i:i + MAX_FRAME_SIZE]
+            for i in range(0, len(header_block), MAX_FRAME_SIZE)
+        ] or [b""]
+        frames = [HeadersFrame(state=self, stream_id=stream_id, header_block_fragment=chunks[0])]
+        frames.extend(
+            ContinuationFrame(state=self, stream_id=stream_id, header_block_fragment=chunk)
+            for chunk in chunks[1:]
+        )
+        if priority:
+            frames[0].flags |= Frame.FLAG_PRIORITY
+            frames[0].exclusive, frames[0].stream_dependency, frames[0].weight = priority
+        if end_stream:
+            frames[0].flags |= Frame.FLAG_END_STREAM
+        frames[-1].flags |= Frame.FLAG_END_HEADERS
+        return frames
+
+    def send_headers(self, stream_id, fields, end_stream=False):
+        with self.lock:
+            self.send_frame(*self._headers_frames(stream_id, fields, end_stream, None))
+
+    def open_stream(self, stream, fields, end_stream=False, priority=None):
+        """
+        Opens a new stream by sending its headers. Waits until the peer accepts another
+        concurrent stream.
+
+        Args:
+            priority: ``(exclusive, dependency, weight)``, or None.
+
+        Returns:
+            The stream id.
+        """
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise TcpDisconnect("HTTP/2 connection closed.")
+                if self.goaway:
+                    raise TcpDisconnect("HTTP/2 connection is going away.")
+                if self.max_concurrent_streams is None or len(self.streams) < self.max_concurrent_streams:
+                    break
+                self.changed.wait()
+            stream_id = self.next_stream_id
+            self.next_stream_id += 2
+            self.stream_opened(stream_id, stream)
+            # Register the stream before the headers are sent, so that the response finds it.
+            self.send_frame(*self._headers_frames(stream_id, fields, end_stream, priority))
+            return stream_id
+
+    def stream_opened(self, stream_id, stream):
+        with self.lock:
+            self.streams[stream_id] = stream
+            self.windows[stream_id] = self.initial_window_size
+
+    def close_stream(self, stream_id):
+        with self.lock:
+            self.streams.pop(stream_id, None)
+            self.windows.pop(stream_id, None)
+            self.changed.notify_all()
+
+    def reset_stream(self, stream_id, error_code):
+        with self.lock:
+            self.close_stream(stream_id)
+            self.send_frame(RstStreamFrame(state=self, stream_id=stream_id, error_code=error_code))
+
+    def send_data(self, stream_id, data, end_stream=False):
+        """
+        Sends data on a stream, split up according to the peer's flow-control windows.
+        Blocks while the windows are exhausted.
+        """
+        if not data and not end_stream:
+            return
+        offset = 0
+        while True:
+            with self.lock:
+                while True:
+                    if self.closed:
+                        raise TcpDisconnect("HTTP/2 connection closed.")
+                    if stream_id not in self.windows:
+                        raise Http2ProtocolException("Stream %d has been closed." % stream_id)
+                    size = min(self.window, self.windows[stream_id], MAX_FRAME_SIZE, len(data) - offset)
+                    if size > 0 or offset == len(data):
+                        break
+                    self.changed.wait()
+                chunk = data[offset:offset + size]
+                offset += size
+                self.window -= size
+                self.windows[stream_id] -= size
+                done = offset == len(data)
+                frm = DataFrame(state=self, stream_id=stream_id, payload=chunk)
+                if done and end_stream:
+                    frm.flags |= Frame.FLAG_END_STREAM
+                self.send_frame(frm)
+            if done:
+                return
+
+    def acknowledge_data(self, stream_id, length):
+        """
+        Allows the peer to send more data on a stream after we have consumed length bytes.
+        """
+        with self.lock:
+            if length > 0 and stream_id in self.streams and not self.closed:
+                self.send_frame(WindowUpdateFrame(state=self, stream_id=stream_id, window_size_increment=length))
+
+    def update_window(self, stream_id, increment):
+        with self.lock:
+            if stream_id == 0:
+                self.window += increment
+            elif stream_id in self.windows:
+                self.windows[stream_id] += increment
+            self.changed.notify_all()
+
+    def apply_settings(self, settings):
+        with self.lock:
+            for setting, value in settings.items():
+                if setting == SettingsFrame.SETTINGS.SETTINGS_INITIAL_WINDOW_SIZE:
+                    delta = value - self.initial_window_size
+                    self.initial_window_size = value
+                    for stream_id in self.windows:
+                        self.windows[stream_id] += delta
+                elif setting == SettingsFrame.SETTINGS.SETTINGS_MAX_CONCURRENT_STREAMS:
+                    self.max_concurrent_streams = value
+                elif setting == SettingsFrame.SETTINGS.SETTINGS_HEADER_TABLE_SIZE:
+                    self.encoder.header_table_size = value
+            self.changed.notify_all()
+            self.send_frame(SettingsFrame(state=self, flags=Frame.FLAG_ACK))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.changed.notify_all()
+
+
+class Http2SingleStreamLayer(_StreamingHttpLayer):
+
+    """
+    A single HTTP/2 stream, i.e. one request and its response, which runs in its own thread.
+    The :py:class:`Http2Layer` passes it the frames it receives for the stream.
+    """
+
+    def __init__(self, ctx, stream_id, request_headers, end_stream, priority):
+        super(Http2SingleStreamLayer, self).__init__(ctx)
+        self.client_stream_id = stream_id
+        self.request_headers = request_headers
+        self.priority = priority
+        self.timestamp_start = utils.timestamp()
+
+        # Items are (data, flow-controlled length) tuples, None at the end of the stream,
+        # or an exception if the stream has been aborted.
+        self.request_data = queue.Queue()
+        # The same, preceded by the response headers.
+        self.response_data = queue.Queue()
+        if end_stream:
+            self.request_data.put(None)
+
+        self.server = None
+        self.server_stream_id = None
+        self.response_headers_received = False
+        self.request_sent = False
+        self.response_complete = False
+        self.client_finished = False
+
+        self.thread = threading.Thread(
+            target=self,
+            name="Http2SingleStreamLayer-{}".format(stream_id)
+        )
+        self.thread.daemon = True
+
+    def abort(self, exc):
+        """
+        Aborts reading from both the client and the server side of the stream.
+        """
+        self.request_data.put(exc)
+        self.response_data.put(exc)
+
+    def _read_body(self, data, conn, stream_id):
+        limit = self.config.body_size_limit
+        size = 0
+        while True:
+            item = data.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            chunk, length = item
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise HttpException("HTTP Body too large. Limit is {}.".format(limit))
+            yield chunk
+            conn.acknowledge_data(stream_id, length)
+
+    def read_request(self):
+        headers = self.request_headers
+        if headers.get("expect", "").lower() == "100-continue":
+            # The client waits for this before it sends the body.
+            self.client.send_headers(self.client_stream_id, [(b":status", b"100")])
+            headers.pop("expect")
+
+        method = headers.pop(":method", b"GET")
+        scheme = headers.pop(":scheme", b"https")
+        path = headers.pop(":path", b"/")
+        authority = headers.pop(":authority", None)
+        for name in [name for name in headers.keys() if name.startswith(":")]:
+            headers.pop(name)
+        if authority and "host" not in headers:
+            # As any intermediary that converts HTTP/2 requests (RFC 7540, Section 8.1.2.3).
+            headers["host"] = authority
+
+        if method == b"CONNECT":
+            form_in = "authority"
+        else:
+            form_in = "relative"
+        host, port = None, None
+        if authority:
+            host, _, port = authority.rpartition(b":")
+            if not host or not port.isdigit():
+                host, port = authority, None
+        port = int(port) if port else (80 if scheme == b"http" else 443)
+
+        body = b"".join(self._read_body(self.request_data, self.client, self.client_stream_id))
+        return HTTPRequest(
+            form_in,
+            method,
+            scheme,
+            host or b"localhost",
+            port,
+            b"" if form_in == "authority" else path,
+            b"HTTP/2.0",
+            headers,
+            body,
+            self.timestamp_start,
+            utils.timestamp(),
+        )
+
+    def read_request_body(self, request):
+        # read_request() always reads the complete request.
+        return []
+
+    def send_request(self, request):
+        authority = request.headers.get("host")
+        if not authority:
+            authority = request.host
+            if request.port != (80 if request.scheme == "http" else 443):
+                authority = "%s:%d" % (authority, request.port)
+        fields = _h2_headers(
+            [
+                (b":method", bytes(request.method)),
+                (b":scheme", bytes(request.scheme)),
+                (b":authority", bytes(authority)),
+                (b":path", bytes(request.path)),
+            ],
+            request.headers
+        )
+        fields = [(name, value) for name, value in fields if name != b"host"]
+
+        self.server = self.ctx.server
+        if not self.server:
+            raise TcpDisconnect("No HTTP/2 server connection.")
+        self.server_stream_id = self.server.open_stream(
+            self, fields, end_stream=not request.body, priority=self.ctx.server_priority(self.priority)
+        )
+        self.server.send_data(self.server_stream_id, request.body, end_stream=True)
+        self.request_sent = True
+
+    def read_response_headers(self):
+        headers = self.response_data.get()
+        if isinstance(headers, Exception):
+            raise headers
+        status_code = headers.pop(":status", b"")
+        for name in [name for name in headers.keys() if name.startswith(":")]:
+            headers.pop(name)
+        try:
+            status_code = int(status_code)
+        except ValueError:
+            raise HttpException("Invalid HTTP/2 response status: %s" % repr(status_code))
+        return HTTPResponse(
+            b"HTTP/2.0",
+            status_code,
+            b"",
+            headers,
+            None,
+            timestamp_start=utils.timestamp(),
+        )
+
+    def read_response_body(self, request, response):
+        return self._read_body(self.response_data, self.server, self.server_stream_id)
+
+    def _send_response_headers(self, response, end_stream):
+        fields = _h2_headers([(b":status", bytes(str(response.status_code)))], response.headers)
+        self.client.send_headers(self.client_stream_id, fields, end_stream)
+        if end_stream:
+            self.client_finished = True
+
+    def send_response_headers(self, response):
+        self._send_response_headers(response, False)
+
+    def send_response_body(self, response, chunks):
+        # Look ahead, so that the last chunk carries the end of the stream.
+        chunk = b""
+        for next_chunk in chunks:
+            self.client.send_data(self.client_stream_id, chunk)
+            chunk = next_chunk
+        self.client.send_data(self.client_stream_id, chunk, end_stream=True)
+        self.client_finished = True
+
+    def send_response(self, response):
+        if response.content == CONTENT_MISSING:
+            raise HttpException("Cannot assemble flow with CONTENT_MISSING")
+        if response.content:
+            self.send_response_headers(response)
+            self.send_response_body(response, [response.content])
+        else:
+            self._send_response_headers(response, True)
+
+    def check_close_connection(self, flow):
+        # Every stream carries exactly one request.
+        return True
+
+    def set_server(self, address, server_tls=None, sni=None):
+        self.ctx.set_server(address, server_tls, sni)
+
+    def connect(self, reuse_tls=None):
+        self.ctx.connect()
+
+    def disconnect(self):
+        # HttpLayer disconnects before it retries a request after a connection error.
+        # The connection is shared with all other streams, so we only drop it if it is broken.
+        self.ctx.server_lost(self.server)
+
+    def __call__(self):
+        layer = HttpLayer(self, self.mode)
+        try:
+            layer()
+        except Kill:
+            self.log("Stream killed", "info")
+        except ProtocolException as e:
+            self.log(repr(e), "info")
+            self.log(traceback.format_exc(), "debug")
+        except Exception:
+            self.log(traceback.format_exc(), "error")
+        finally:
+            self.ctx.stream_done(self)
+
+    def __repr__(self):
+        return "Http2SingleStreamLayer({})".format(self.client_stream_id)
+
+
+class Http2Layer(Layer):
+
+    """
+    Multiplexes HTTP/2 streams between the client and the server.
+
+    Each stream the client opens is handled by an :py:class:`Http2SingleStreamLayer` in its own
+    thread, so that requests are processed concurrently and their flows pass through the
+    master independently. All streams share the server connection. This layer reads the frames
+    on both connections, dispatches them to the streams and takes care of connection-level
+    frames (SETTINGS, PING, WINDOW_UPDATE, GOAWAY). PRIORITY information is forwarded to the
+    server with the stream ids mapped.
+    """
+
+    def __init__(self, ctx, mode):
+        super(Http2Layer, self).__init__(ctx)
+        self.mode = mode
+        self.client = Http2Connection(self.client_conn)
+        self.client.max_concurrent_streams = MAX_CONCURRENT_STREAMS
+        self.server = None
+        self._server_lock = threading.RLock()
+        self._threads = []
+        self._last_client_stream_id = 0
+        self._client_goaway = False
+        self._wakeup_r, self._wakeup_w = None, None
+
+    def _wakeup(self):
+        if self._wakeup_w is not None:
+            try:
+                os.write(self._wakeup_w, b"x")
+            except OSError:
+                pass
+
+    def _initiate_server_conn(self):
+        server = Http2Connection(self.server_conn)
+        server.conn.wfile.write(frame.CLIENT_CONNECTION_PREFACE)
+        server.send_frame(SettingsFrame(state=server, settings={
+            SettingsFrame.SETTINGS.SETTINGS_ENABLE_PUSH: 0,
+        }))
+        self.server = server
+        self._wakeup()
+
+    def connect(self, reuse_tls=None):
+        with self._server_lock:
+            if self.server_conn and self.server:
+                # Another stream has connected in the meantime.
+                return
+            if not self.server_conn:
+                self.ctx.connect()
+            if self.server_conn.get_alpn_proto_negotiated() != b"h2":
+                raise Http2ProtocolException("The server does not support HTTP/2.")
+            try:
+                self._initiate_server_conn()
+            except NetlibException as e:
+                raise ProtocolException("Cannot initiate HTTP/2 connection: %s" % repr(e))
+
+    def set_server(self, address, server_tls=None, sni=None):
+        with self._server_lock:
+            if self.server_conn:
+                raise Http2ProtocolException(
+                    "All HTTP/2 streams share the server connection, "
+                    "they cannot be sent to a different server."
+                )
+            self.ctx.set_server(address, server_tls, sni)
+
+    def server_lost(self, server):
+        """
+        Drops a broken server connection. The next stream establishes a new one.
+        """
+        with self._server_lock:
+            if server is not self.server:
+                # Someone else has already taken care of it.
+                return
+            self.server = None
+            if server:
+                server.close()
+                for stream in list(server.streams.values()):
+                    stream.response_data.put(TcpDisconnect("Server connection lost."))
+            if self.server_conn:
+                self.ctx.disconnect()
+        self._wakeup()
+
+    def server_priority(self, priority):
+        """
+        Maps a stream priority on the client connection to the server connection.
+        """
+        if not priority:
+            return None
+        exclusive, dependency, weight = priority
+        parent = self.client.streams.get(dependency)
+        if parent and parent.server is self.server and parent.server_stream_id:
+            dependency = parent.server_stream_id
+        else:
+            dependency = 0
+        return exclusive, dependency, weight
+
+    def stream_done(self, stream):
+        if not stream.client_finished:
+            try:
+                self.client.reset_stream(stream.client_stream_id, ERROR_CODES.INTERNAL_ERROR)
+            except NetlibException:
+                pass
+        self.client.close_stream(stream.client_stream_id)
+        if stream.server and stream.server_stream_id:
+            if not (stream.request_sent and stream.response_complete):
+                try:
+                    stream.server.reset_stream(stream.server_stream_id, ERROR_CODES.CANCEL)
+                except NetlibException:
+                    pass
+            stream.server.close_stream(stream.server_stream_id)
+        self._wakeup()
+
+    def _read_header_block(self, conn, frm):
+        header_block = frm.header_block_fragment
+        while not frm.flags & Frame.FLAG_END_HEADERS:
+            frm = conn.read_frame()
+            if not isinstance(frm, ContinuationFrame):
+                raise Http2ProtocolException("Expected CONTINUATION frame, got %s." % repr(frm))
+            header_block += frm.header_block_fragment
+        return conn.decode_headers(header_block)
+
+    def _handle_common_frame(self, conn, frm):
+        """
+        Handles connection-level frames that are the same for both connections.
+
+        Returns:
+            True, if the frame has been handled.
+        """
+        if isinstance(frm, SettingsFrame):
+            if not frm.flags & Frame.FLAG_ACK:
+                conn.apply_settings(frm.settings)
+        elif isinstance(frm, PingFrame):
+            if not frm.flags & Frame.FLAG_ACK:
+                conn.send_frame(PingFrame(state=conn, flags=Frame.FLAG_ACK, payload=frm.payload))
+        elif isinstance(frm, WindowUpdateFrame):
+            conn.update_window(frm.stream_id, frm.window_size_increment)
+        elif isinstance(frm, DataFrame):
+            # The stream acknowledges the data once it has consumed it.
+            # Connection-level flow control must not hold up other streams though.
+            if frm.length:
+                conn.send_frame(WindowUpdateFrame(state=conn, stream_id=0, window_size_increment=frm.length))
+            return False
+        else:
+            return False
+        return True
+
+    def _handle_client_frame(self, frm):
+        if frm is None or self._handle_common_frame(self.client, frm):
+            return
+        stream = self.client.streams.get(frm.stream_id)
+
+        if isinstance(frm, HeadersFrame):
+            headers = self._read_header_block(self.client, frm)
+            end_stream = bool(frm.flags & Frame.FLAG_END_STREAM)
+            if stream:
+                # Trailers, which we do not forward.
+                if end_stream:
+                    stream.request_data.put(None)
+                return
+            if frm.stream_id <= self._last_client_stream_id or self._client_goaway:
+                return
+            self._last_client_stream_id = frm.stream_id
+            if len(self.client.streams) >= MAX_CONCURRENT_STREAMS:
+                self.client.send_frame(RstStreamFrame(
+                    state=self.client, stream_id=frm.stream_id, error_code=ERROR_CODES.REFUSED_STREAM
+                ))
+                return
+            priority = None
+            if frm.flags & Frame.FLAG_PRIORITY:
+                priority = (frm.exclusive, frm.stream_dependency, frm.weight)
+            stream = Http2SingleStreamLayer(self, frm.stream_id, headers, end_stream, priority)
+            self.client.stream_opened(frm.stream_id, stream)
+            self._threads.append(stream.thread)
+            stream.thread.start()
+
+        elif isinstance(frm, DataFrame):
+            if stream:
+                stream.request_data.put((frm.payload, frm.length))
+                if frm.flags & Frame.FLAG_END_STREAM:
+                    stream.request_data.put(None)
+
+        elif isinstance(frm, PriorityFrame):
+            priority = (frm.exclusive, frm.stream_dependency, frm.weight)
+            if stream and stream.server_stream_id:
+                exclusive, dependency, weight = self.server_priority(priority)
+                try:
+                    stream.server.send_frame(PriorityFrame(
+                        state=stream.server,
+                        stream_id=stream.server_stream_id,
+                        exclusive=exclusive,
+                        stream_dependency=dependency,
+                        weight=weight
+                    ))
+                except NetlibException:
+                    pass
+            elif stream:
+                # Not sent to the server yet.
+                stream.priority = priority
+
+        elif isinstance(frm, RstStreamFrame):
+            if stream:
+                stream.client_finished = True
+                self.client.close_stream(frm.stream_id)
+                stream.abort(Http2ProtocolException(
+                    "Stream reset by client: %s" % ERROR_CODES.get_name(frm.error_code)
+                ))
+
+        elif isinstance(frm, GoAwayFrame):
+            # The client does not open new streams anymore.
+            # We are done once the existing ones are finished.
+            self._client_goaway = True
+
+        elif isinstance(frm, PushPromiseFrame):
+            raise Http2ProtocolException("Clients must not push streams.")
+
+    def _handle_server_frame(self, server, frm):
+        if frm is None or self._handle_common_frame(server, frm):
+            return
+        stream = server.streams.get(frm.stream_id)
+
+        if isinstance(frm, HeadersFrame):
+            headers = self._read_header_block(server, frm)
+            if not stream:
+                return
+            if not stream.response_headers_received:
+                if headers.get(":status", "").startswith("1"):
+                    # Informational response.
+                    return
+                stream.response_headers_received = True
+                stream.response_data.put(headers)
+            # Otherwise, these are trailers, which we do not forward.
+            if frm.flags & Frame.FLAG_END_STREAM:
+                stream.response_complete = True
+                stream.response_data.put(None)
+
+        elif isinstance(frm, DataFrame):
+            if stream:
+                stream.response_data.put((frm.payload, frm.length))
+                if frm.flags & Frame.FLAG_END_STREAM:
+                    stream.response_complete = True
+                    stream.response_data.put(None)
+
+        elif isinstance(frm, RstStreamFrame):
+            if stream:
+                stream.response_complete = True
+                server.close_stream(frm.stream_id)
+                stream.response_data.put(Http2ProtocolException(
+                    "Stream reset by server: %s" % ERROR_CODES.get_name(frm.error_code)
+                ))
+
+        elif isinstance(frm, GoAwayFrame):
+            # The server does not process any streams above last_stream, new requests need a new
+            # connection. HttpLayer retries them once their stream has failed.
+            with server.lock:
+                server.goaway = True
+                refused = [s for sid, s in server.streams.items() if sid > frm.last_stream]
+            for s in refused:
+                s.response_data.put(TcpDisconnect("Stream refused by server (GOAWAY)."))
+
+        elif isinstance(frm, PushPromiseFrame):
+            # We have disabled server push, but still need to keep the HPACK state in sync.
+            self._read_header_block(server, frm)
+            server.send_frame(RstStreamFrame(
+                state=server, stream_id=frm.promised_stream, error_code=ERROR_CODES.REFUSED_STREAM
+            ))
+
+    def _readable(self):
+        conns = {self.client_conn.connection: self.client}
+        server = self.server
+        if server:
+            conns[server.conn.connection] = server
+        buffered = [conn for conn in conns.values() if conn.has_buffered_data()]
+        if buffered:
+            return buffered
+        ready = tcp.ssl_read_select(list(conns.keys()) + [self._wakeup_r], None)
+        if self._wakeup_r in ready:
+            os.read(self._wakeup_r, 4096)
+        return [conns[c] for c in ready if c in conns]
+
+    def __call__(self):
+        try:
+            preface = self.client_conn.rfile.safe_read(len(frame.CLIENT_CONNECTION_PREFACE))
+            if preface != frame.CLIENT_CONNECTION_PREFACE:
+                raise Http2ProtocolException("Invalid HTTP/2 connection preface: %s" % repr(preface))
+            self.client.send_frame(SettingsFrame(state=self.client, settings={
+                SettingsFrame.SETTINGS.SETTINGS_MAX_CONCURRENT_STREAMS: MAX_CONCURRENT_STREAMS,
+            }))
+            if self.server_conn:
+                self._initiate_server_conn()
+        except NetlibException as e:
+            raise ProtocolException("Cannot initiate HTTP/2 connection: %s" % repr(e))
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        try:
+            while not (self._client_goaway and not self.client.streams):
+                for conn in self._readable():
+                    if conn is self.client:
+                        try:
+                            frm = self.client.read_frame()
+                        except NetlibException:
+                            # The client has closed the connection.
+                            return
+                        self._handle_client_frame(frm)
+                    else:
+                        try:
+                            frm = conn.read_frame()
+                            self._handle_server_frame(conn, frm)
+                        except NetlibException as e:
+                            self.log("HTTP/2 server connection lost: %s" % repr(e), "debug")
+                            self.server_lost(conn)
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        for stream in list(self.client.streams.values()):
+            stream.abort(TcpDisconnect("Client connection closed."))
+        # Wake up streams that wait for flow-control windows.
+        self.client.close()
+        if self.server:
+            self.server.close()
+        for thread in self._threads:
+            thread.join()
+        try:
+            self.client_conn.send(GoAwayFrame(state=self.client, last_stream=self._last_client_stream_id).to_bytes())
+        except NetlibException:
+            pass
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        self._wakeup_r, self._wakeup_w = None, None
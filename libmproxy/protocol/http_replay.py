@@ -8,6 +8,7 @@ from netlib.http import http1
 from ..controller import Channel
 from ..models import Error, HTTPResponse, ServerConnection, make_connect_request
 from .base import Kill
+from .http import server_keep_alive
 
 
 # TODO: Doesn't really belong into libmproxy.protocol...
@@ -44,10 +45,15 @@ class RequestReplayThread(threading.Thread):
 
             if not self.flow.response:
                 # In all modes, we directly connect to the server displayed
+                pool = self.config.connection_pool
                 if self.config.mode == "upstream":
                     server_address = self.config.upstream_server.address
-                    server = ServerConnection(server_address, (self.config.host, 0))
-                    server.connect()
+                    server = None
+                    if r.scheme != "https":
+                        server = pool.get(server_address)
+                    if not server:
+                        server = ServerConnection(server_address, (self.config.host, 0))
+                        server.connect()
                     if r.scheme == "https":
                         connect_request = make_connect_request((r.host, r.port))
                         server.wfile.write(http1.assemble_request(connect_request))
@@ -61,20 +67,31 @@ class RequestReplayThread(threading.Thread):
                             raise ReplayException("Upstream server refuses CONNECT request")
                         server.establish_ssl(
                             self.config.clientcerts,
-                            sni=self.flow.server_conn.sni
+                            sni=self.flow.server_conn.sni,
+                            session_cache=self.config.tls_session_cache
                         )
                         r.form_out = "relative"
                     else:
                         r.form_out = "absolute"
                 else:
                     server_address = (r.host, r.port)
-                    server = ServerConnection(server_address, (self.config.host, 0))
-                    server.connect()
-                    if r.scheme == "https":
-                        server.establish_ssl(
-                            self.config.clientcerts,
-                            sni=self.flow.server_conn.sni
-                        )
+                    tls = r.scheme == "https"
+                    server = pool.get(
+                        server_address,
+                        tls,
+                        self.flow.server_conn.sni,
+                        None,
+                        self.config.clientcerts
+                    )
+                    if not server:
+                        server = ServerConnection(server_address, (self.config.host, 0))
+                        server.connect()
+                        if tls:
+                            server.establish_ssl(
+                                self.config.clientcerts,
+                                sni=self.flow.server_conn.sni,
+                                session_cache=self.config.tls_session_cache
+                            )
                     r.form_out = "relative"
 
                 server.wfile.write(http1.assemble_request(r))
@@ -85,6 +102,12 @@ class RequestReplayThread(threading.Thread):
                     r,
                     body_size_limit=self.config.body_size_limit
                 ))
+                # A CONNECT tunnel through an upstream proxy must not be reused for other hosts.
+                tunnel = self.config.mode == "upstream" and r.scheme == "https"
+                server.keep_alive = not tunnel and server_keep_alive(r, self.flow.response)
+                if not pool.put(server):
+                    server.finish()
+                    server.close()
             if self.channel:
                 response_reply = self.channel.ask("response", self.flow)
                 if response_reply == Kill:
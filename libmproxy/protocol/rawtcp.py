@@ -8,6 +8,7 @@ from netlib.exceptions import TcpException
 
 from netlib.tcp import ssl_read_select
 from netlib.utils import clean_bin
+from .. import platform
 from ..exceptions import ProtocolException
 from .base import Layer
 
@@ -23,12 +24,21 @@ class TcpMessage(object):
 
 
 class RawTCPLayer(Layer):
-    chunk_size = 4096
+    chunk_size = 65536
 
     def __init__(self, ctx, logging=True):
         self.logging = logging
         super(RawTCPLayer, self).__init__(ctx)
 
+    def passthrough(self):
+        """
+        Returns True if the data only needs to be relayed, i.e. we neither log it nor is there
+        anyone interested in tcp_message events. Scripts may be loaded at any time, so this is
+        checked again for every chunk.
+        """
+        subscribed = self.channel.subscribed
+        return not self.logging and subscribed is not None and not subscribed("tcp_message", None)
+
     def __call__(self):
         self.connect()
 
@@ -38,13 +48,23 @@ class RawTCPLayer(Layer):
         server = self.server_conn.connection
         conns = [client, server]
 
+        splicers = {}
+        if platform.splicer and not isinstance(client, SSL.Connection) and not isinstance(server, SSL.Connection):
+            splicers = {client: platform.splicer(), server: platform.splicer()}
+
         try:
             while True:
                 r = ssl_read_select(conns, 10)
                 for conn in r:
                     dst = server if conn == client else client
 
-                    size = conn.recv_into(buf, self.chunk_size)
+                    passthrough = self.passthrough()
+                    if passthrough and splicers:
+                        size = splicers[conn].transfer(conn, dst)
+                        if size is None:
+                            continue
+                    else:
+                        size = conn.recv_into(buf, self.chunk_size)
                     if not size:
                         conns.remove(conn)
                         # Shutdown connection to the other peer
@@ -59,6 +79,11 @@ class RawTCPLayer(Layer):
                             return
                         continue
 
+                    if passthrough:
+                        if not splicers:
+                            dst.sendall(buf[:size])
+                        continue
+
                     tcp_message = TcpMessage(
                         self.client_conn, self.server_conn,
                         self.client_conn if dst == server else self.server_conn,
@@ -86,3 +111,6 @@ class RawTCPLayer(Layer):
                 ProtocolException("TCP connection closed unexpectedly: {}".format(repr(e))),
                 sys.exc_info()[2]
             )
+        finally:
+            for splicer in splicers.values():
+                splicer.close()
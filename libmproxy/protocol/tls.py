@@ -299,6 +299,33 @@ class TlsClientHello(object):
             (self.client_sni, self.client_alpn_protocols, self.client_cipher_suites)
 
 
+# One callback per choice, so that client connections can share their SSL context
+# (see libmproxy.proxy.session_cache.TlsContextCache).
+_alpn_select_callbacks = {}
+
+
+def alpn_select_callback(server_alpn):
+    """
+    Returns an ALPN select callback for client connections, which picks the protocol that has
+    been negotiated with the server, or http/1.1.
+    """
+    if server_alpn in _alpn_select_callbacks:
+        return _alpn_select_callbacks[server_alpn]
+
+    # This gets triggered if we haven't established an upstream connection yet.
+    default_alpn = b'http/1.1'
+
+    def select(conn_, options):
+        if server_alpn in options:
+            return bytes(server_alpn)
+        elif default_alpn in options:
+            return bytes(default_alpn)
+        else:
+            return options[0]
+
+    return _alpn_select_callbacks.setdefault(server_alpn, select)
+
+
 class TlsLayer(Layer):
 
     def __init__(self, ctx, client_tls, server_tls):
@@ -371,9 +398,11 @@ class TlsLayer(Layer):
         except TlsProtocolException as e:
             self.log("Cannot parse Client Hello: %s" % repr(e), "error")
 
-    def connect(self):
+    def connect(self, reuse_tls=None):
         if not self.server_conn:
-            self.ctx.connect()
+            if self._server_tls:
+                reuse_tls = (self.sni_for_server_connection, self.alpn_for_server_connection)
+            self.ctx.connect(reuse_tls=reuse_tls)
         if self._server_tls and not self.server_conn.tls_established:
             self._establish_tls_with_server()
 
@@ -390,35 +419,29 @@ class TlsLayer(Layer):
         else:
             return self._sni_from_server_change or self.client_sni
 
+    @property
+    def alpn_for_server_connection(self):
+        # We only support http/1.1 and h2.
+        # If the server only supports spdy (next to http/1.1), it may select that
+        # and mitmproxy would enter TCP passthrough mode, which we want to avoid.
+        deprecated_http2_variant = lambda x: x.startswith("h2-") or x.startswith("spdy")
+        if self.client_alpn_protocols:
+            alpn = [x for x in self.client_alpn_protocols if not deprecated_http2_variant(x)]
+        else:
+            alpn = None
+        if alpn and "h2" in alpn and not self.config.http2:
+            alpn.remove("h2")
+        return alpn
+
     @property
     def alpn_for_client_connection(self):
         return self.server_conn.get_alpn_proto_negotiated()
 
-    def __alpn_select_callback(self, conn_, options):
-        """
-        Once the client signals the alternate protocols it supports,
-        we reconnect upstream with the same list and pass the server's choice down to the client.
-        """
-
-        # This gets triggered if we haven't established an upstream connection yet.
-        default_alpn = b'http/1.1'
-        # alpn_preference = b'h2'
-
-        if self.alpn_for_client_connection in options:
-            choice = bytes(self.alpn_for_client_connection)
-        elif default_alpn in options:
-            choice = bytes(default_alpn)
-        else:
-            choice = options[0]
-        self.log("ALPN for client: %s" % choice, "debug")
-        return choice
-
     def _establish_tls_with_client_and_server(self):
         # If establishing TLS with the server fails, we try to establish TLS with the client nonetheless
         # to send an error message over TLS.
         try:
-            self.ctx.connect()
-            self._establish_tls_with_server()
+            self.connect()
         except Exception as e:
             try:
                 self._establish_tls_with_client()
@@ -440,8 +463,17 @@ class TlsLayer(Layer):
                 cipher_list=self.config.ciphers_client,
                 dhparams=self.config.certstore.dhparams,
                 chain_file=chain_file,
-                alpn_select_callback=self.__alpn_select_callback,
+                # Once the client signals the alternate protocols it supports,
+                # we pass the server's choice down to the client.
+                alpn_select_callback=alpn_select_callback(self.alpn_for_client_connection),
+                # We never ask for client certificates. This keeps netlib from tying the
+                # (shared) context to this connection.
+                verify_options=None,
+                context_cache=self.config.client_tls_context_cache,
             )
+            alpn = self.client_conn.get_alpn_proto_negotiated()
+            if alpn:
+                self.log("ALPN for client: %s" % alpn, "debug")
             # Some TLS clients will not fail the handshake,
             # but will immediately throw an "unexpected eof" error on the first read.
             # The reason for this might be difficult to find, so we try to peek here to see if it
@@ -462,17 +494,6 @@ class TlsLayer(Layer):
     def _establish_tls_with_server(self):
         self.log("Establish TLS with server", "debug")
         try:
-            # We only support http/1.1 and h2.
-            # If the server only supports spdy (next to http/1.1), it may select that
-            # and mitmproxy would enter TCP passthrough mode, which we want to avoid.
-            deprecated_http2_variant = lambda x: x.startswith("h2-") or x.startswith("spdy")
-            if self.client_alpn_protocols:
-                alpn = [x for x in self.client_alpn_protocols if not deprecated_http2_variant(x)]
-            else:
-                alpn = None
-            if alpn and "h2" in alpn and not self.config.http2:
-                alpn.remove("h2")
-
             ciphers_server = self.config.ciphers_server
             if not ciphers_server:
                 ciphers_server = []
@@ -490,7 +511,8 @@ class TlsLayer(Layer):
                 ca_path=self.config.openssl_trusted_cadir_server,
                 ca_pemfile=self.config.openssl_trusted_ca_server,
                 cipher_list=ciphers_server,
-                alpn_protos=alpn,
+                alpn_protos=self.alpn_for_server_connection,
+                session_cache=self.config.tls_session_cache,
             )
             tls_cert_err = self.server_conn.ssl_verification_error
             if tls_cert_err is not None:
@@ -529,24 +551,17 @@ class TlsLayer(Layer):
         self.log("ALPN selected by server: %s" % self.alpn_for_client_connection, "debug")
 
     def _find_cert(self):
-        host = self.server_conn.address.host
-        sans = set()
+        from ..proxy.certstore import cert_params
         # Incorporate upstream certificate
         use_upstream_cert = (
             self.server_conn and
             self.server_conn.tls_established and
             (not self.config.no_upstream_cert)
         )
-        if use_upstream_cert:
-            upstream_cert = self.server_conn.cert
-            sans.update(upstream_cert.altnames)
-            if upstream_cert.cn:
-                sans.add(host)
-                host = upstream_cert.cn.decode("utf8").encode("idna")
-        # Also add SNI values.
-        if self.client_sni:
-            sans.add(self.client_sni)
-        if self._sni_from_server_change:
-            sans.add(self._sni_from_server_change)
-
-        return self.config.certstore.get_cert(host, list(sans))
+        host, sans = cert_params(
+            self.server_conn.address.host,
+            self.server_conn.cert if use_upstream_cert else None,
+            # Also add SNI values.
+            [self.client_sni, self._sni_from_server_change]
+        )
+        return self.config.certstore.get_cert(host, sans)
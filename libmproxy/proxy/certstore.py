@@ -0,0 +1,284 @@
+from __future__ import (absolute_import, print_function, division)
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+import OpenSSL
+from six.moves import queue
+
+from netlib import certutils, tcp
+from netlib.exceptions import NetlibException
+
+DEFAULT_PREWARM_THREADS = 4
+
+
+def cert_params(host, upstream_cert=None, snis=()):
+    """
+    Returns the (commonname, sans) of the interception certificate for a host.
+
+    Args:
+        upstream_cert: The certificate of the upstream server, if it is used as a template.
+        snis: Additional server names, e.g. the SNI sent by the client.
+    """
+    sans = set()
+    if upstream_cert:
+        sans.update(upstream_cert.altnames)
+        if upstream_cert.cn:
+            sans.add(host)
+            host = upstream_cert.cn.decode("utf8").encode("idna")
+    sans.update(sni for sni in snis if sni)
+    # Sorted, so that the same names always yield the same certificate.
+    return host, sorted(sans)
+
+
+class CertStore(certutils.CertStore):
+
+    """
+    Extends netlib's in-memory certificate store with
+
+    - an optional persistent cache of generated certificates in the CA directory, so that they
+      survive restarts,
+    - pre-warming, i.e. generating certificates in background threads before they are needed,
+    - statistics on cache hits and generation latency.
+
+    A certificate is only generated once: if a connection needs a certificate that is currently
+    being generated by another thread, it waits for it.
+    """
+
+    def __init__(self, default_privatekey, default_ca, default_chain_file, dhparams, cache_dir=None):
+        super(CertStore, self).__init__(default_privatekey, default_ca, default_chain_file, dhparams)
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._pending = {}  # (commonname, sans) -> threading.Event
+        self.hits = 0
+        self.disk_hits = 0
+        self.minted = 0
+        self.mint_time = 0
+        self.max_mint_time = 0
+        self.prewarmed = 0
+
+    @classmethod
+    def from_store(cls, path, basename, cache=False):
+        """
+        Args:
+            cache: If True, generated certificates are kept in ``path/<basename>-certs``.
+        """
+        store = super(CertStore, cls).from_store(path, basename)
+        if cache:
+            store.cache_dir = os.path.join(path, basename + "-certs")
+            if not os.path.exists(store.cache_dir):
+                os.makedirs(store.cache_dir)
+        return store
+
+    def _lookup(self, commonname, sans):
+        potential_keys = self.asterisk_forms(commonname)
+        for s in sans:
+            potential_keys.extend(self.asterisk_forms(s))
+        potential_keys.append((commonname, tuple(sans)))
+        for key in potential_keys:
+            if key in self.certs:
+                return self.certs[key]
+        return None
+
+    def _cache_path(self, key):
+        h = hashlib.sha256(self.default_ca.digest("sha256"))
+        h.update(repr(key))
+        return os.path.join(self.cache_dir, h.hexdigest() + ".pem")
+
+    def _load(self, key):
+        try:
+            with open(self._cache_path(key), "rb") as f:
+                cert = certutils.SSLCert.from_pem(f.read())
+        except (IOError, OpenSSL.crypto.Error):
+            return None
+        if cert.has_expired:
+            return None
+        return cert
+
+    def _save(self, key, cert):
+        path = self._cache_path(key)
+        tmp = "%s.%s.tmp" % (path, threading.current_thread().ident)
+        try:
+            with open(tmp, "wb") as f:
+                f.write(cert.to_pem())
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            # The cache is an optimization only.
+            pass
+
+    def _mint(self, commonname, sans):
+        start = time.time()
+        cert = certutils.dummy_cert(self.default_privatekey, self.default_ca, commonname, sans)
+        duration = time.time() - start
+        with self._lock:
+            self.minted += 1
+            self.mint_time += duration
+            self.max_mint_time = max(self.max_mint_time, duration)
+        return cert
+
+    def _get_entry(self, commonname, sans, prewarm=False):
+        key = (commonname, tuple(sans))
+        while True:
+            with self._lock:
+                entry = self._lookup(commonname, sans)
+                if entry:
+                    if not prewarm:
+                        self.hits += 1
+                    return entry
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Another thread is generating this certificate right now.
+            pending.wait()
+        try:
+            cert = self._load(key) if self.cache_dir else None
+            if cert:
+                with self._lock:
+                    self.disk_hits += 1
+            else:
+                cert = self._mint(commonname, sans)
+                if self.cache_dir:
+                    self._save(key, cert)
+            entry = certutils.CertStoreEntry(cert, self.default_privatekey, self.default_chain_file)
+            with self._lock:
+                self.certs[key] = entry
+                if prewarm:
+                    self.prewarmed += 1
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return entry
+
+    def get_cert(self, commonname, sans):
+        entry = self._get_entry(commonname, sans)
+        return entry.cert, entry.privatekey, entry.chain_file
+
+    def prewarm(self, items, threads=DEFAULT_PREWARM_THREADS):
+        """
+        Generates certificates in background threads.
+
+        Args:
+            items: Callables that return the (commonname, sans) of a certificate,
+                see :py:func:`prewarm_items`.
+
+        Returns:
+            The worker threads.
+        """
+        q = queue.Queue()
+        for item in items:
+            q.put(item)
+
+        def work():
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._get_entry(*item(), prewarm=True)
+                except Exception:
+                    # Names that we cannot generate a certificate for fail again once they
+                    # are requested, which is where we report it.
+                    pass
+
+        workers = [
+            threading.Thread(target=work, name="CertPrewarmThread")
+            for _ in range(min(threads, q.qsize()))
+        ]
+        for t in workers:
+            t.daemon = True
+            t.start()
+        return workers
+
+    def get_state(self):
+        return dict(
+            size=len(self.certs),
+            hits=self.hits,
+            disk_hits=self.disk_hits,
+            minted=self.minted,
+            mint_time=self.mint_time,
+            max_mint_time=self.max_mint_time,
+            prewarmed=self.prewarmed,
+        )
+
+    def summary(self):
+        state = self.get_state()
+        return (
+            "{size} certificates, {hits} cache hits, {disk_hits} loaded from disk, "
+            "{prewarmed} prewarmed, {minted} generated (avg {avg:.1f}ms, max {max:.1f}ms)"
+        ).format(
+            avg=1000 * state["mint_time"] / state["minted"] if state["minted"] else 0,
+            max=1000 * state["max_mint_time"],
+            **state
+        )
+
+
+def fetch_upstream_cert(address, sni):
+    """
+    Returns the certificate of the server at address, or None if we cannot get it.
+    """
+    c = tcp.TCPClient(address)
+    try:
+        c.connect()
+        c.convert_to_ssl(sni=sni)
+        return c.cert
+    except NetlibException:
+        return None
+    finally:
+        if c.connection:
+            c.close()
+
+
+def prewarm_items(path, use_upstream_cert=True):
+    """
+    Reads what to pre-warm the certificate store with from a file, which is either a flow file or
+    a list of ``host[:port]`` lines. For hosts, the upstream certificates are fetched first unless
+    use_upstream_cert is False.
+
+    Returns:
+        Callables for :py:meth:`CertStore.prewarm`.
+
+    Raises:
+        IOError, if the file cannot be read.
+        ValueError, if the file is invalid.
+    """
+    with open(path, "rb") as f:
+        is_flow_file = re.match(br"\d+:", f.read(16))
+    if is_flow_file:
+        from ..flow import FlowReader, FlowReadError
+        params = set()
+        with open(path, "rb") as f:
+            try:
+                for flow in FlowReader(f).stream():
+                    server_conn = flow.server_conn
+                    if not (server_conn.address and flow.client_conn.ssl_established):
+                        continue
+                    cn, sans = cert_params(
+                        server_conn.address.host,
+                        server_conn.cert if use_upstream_cert else None,
+                        [server_conn.sni]
+                    )
+                    params.add((cn, tuple(sans)))
+            except FlowReadError as e:
+                raise ValueError(e.strerror)
+        return [lambda cn=cn, sans=sans: (cn, list(sans)) for cn, sans in sorted(params)]
+
+    items = []
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            host, _, port = line.partition(b":")
+            address = (host, int(port) if port else 443)
+
+            def item(host=host, address=address):
+                upstream_cert = fetch_upstream_cert(address, host) if use_upstream_cert else None
+                return cert_params(host, upstream_cert, [host])
+            items.append(item)
+    return items
@@ -4,14 +4,19 @@ import os
 import re
 from OpenSSL import SSL
 
-from netlib import certutils, tcp
+from netlib import tcp
 from netlib.http import authentication
 from netlib.tcp import Address, sslversion_choices
 
 from .. import utils, platform
+from .certstore import CertStore, prewarm_items
+from .pool import ConnectionPool, DEFAULT_POOL_SIZE
+from .session_cache import TlsSessionCache, TlsContextCache, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
 
 CONF_BASENAME = "mitmproxy"
 CA_DIR = "~/.mitmproxy"
+# threading.stack_size() refuses anything below 32KiB.
+MIN_THREAD_STACK_SIZE = 32 * 1024
 
 # We manually need to specify this, otherwise OpenSSL may select a non-HTTP2 cipher by default.
 # https://mozilla.github.io/server-side-tls/ssl-config-generator/?server=apache-2.2.15&openssl=1.0.2&hsts=yes&profile=old
@@ -66,6 +71,13 @@ class ProxyConfig:
             ssl_verify_upstream_cert=False,
             ssl_verify_upstream_trusted_cadir=None,
             ssl_verify_upstream_trusted_ca=None,
+            thread_stack_size=None,
+            event_loop=False,
+            upstream_pool_size=DEFAULT_POOL_SIZE,
+            tls_session_cache_size=DEFAULT_CACHE_SIZE,
+            tls_session_cache_ttl=DEFAULT_CACHE_TTL,
+            cert_cache=False,
+            cert_prewarm=None,
     ):
         self.host = host
         self.port = port
@@ -85,11 +97,18 @@ class ProxyConfig:
         self.http2 = http2
         self.rawtcp = rawtcp
         self.authenticator = authenticator
+        self.thread_stack_size = thread_stack_size
+        self.event_loop = event_loop
+        self.connection_pool = ConnectionPool(upstream_pool_size)
+        self.tls_session_cache = TlsSessionCache(tls_session_cache_size, tls_session_cache_ttl)
+        self.client_tls_context_cache = TlsContextCache()
         self.cadir = os.path.expanduser(cadir)
-        self.certstore = certutils.CertStore.from_store(
+        self.certstore = CertStore.from_store(
             self.cadir,
-            CONF_BASENAME
+            CONF_BASENAME,
+            cache=cert_cache
         )
+        self.cert_prewarm = cert_prewarm
         for spec, cert in certs:
             self.certstore.add_cert_file(spec, cert)
 
@@ -170,6 +189,28 @@ def process_proxy_options(parser, options):
     else:
         authenticator = authentication.NullProxyAuth(None)
 
+    thread_stack_size = utils.parse_size(options.thread_stack_size)
+    if thread_stack_size is not None and thread_stack_size < MIN_THREAD_STACK_SIZE:
+        return parser.error(
+            "Thread stack size must be at least %s bytes." % MIN_THREAD_STACK_SIZE
+        )
+
+    if options.upstream_pool_size < 0:
+        return parser.error("Upstream pool size must not be negative.")
+
+    if options.tls_session_cache_size < 0:
+        return parser.error("TLS session cache size must not be negative.")
+    if options.tls_session_cache_ttl <= 0:
+        return parser.error("TLS session lifetime must be positive.")
+
+    cert_prewarm = None
+    if options.cert_prewarm:
+        path = os.path.expanduser(options.cert_prewarm)
+        try:
+            cert_prewarm = prewarm_items(path, not options.no_upstream_cert)
+        except (IOError, ValueError) as e:
+            return parser.error("Invalid certificate pre-warming file: %s" % e)
+
     certs = []
     for i in options.certs:
         parts = i.split("=", 1)
@@ -201,5 +242,12 @@ def process_proxy_options(parser, options):
         ssl_version_server=options.ssl_version_server,
         ssl_verify_upstream_cert=options.ssl_verify_upstream_cert,
         ssl_verify_upstream_trusted_cadir=options.ssl_verify_upstream_trusted_cadir,
-        ssl_verify_upstream_trusted_ca=options.ssl_verify_upstream_trusted_ca
+        ssl_verify_upstream_trusted_ca=options.ssl_verify_upstream_trusted_ca,
+        thread_stack_size=thread_stack_size,
+        event_loop=options.event_loop,
+        upstream_pool_size=options.upstream_pool_size,
+        tls_session_cache_size=options.tls_session_cache_size,
+        tls_session_cache_ttl=options.tls_session_cache_ttl,
+        cert_cache=options.cert_cache,
+        cert_prewarm=cert_prewarm
     )
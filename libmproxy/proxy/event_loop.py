@@ -0,0 +1,116 @@
+from __future__ import (absolute_import, print_function, division)
+
+import errno
+import os
+import select
+import threading
+
+from netlib import tcp
+
+
+class _Poller(object):
+
+    """
+    Minimal wrapper around epoll (Linux) or poll, which, unlike select, scale to many
+    thousand file descriptors.
+    """
+
+    def __init__(self):
+        if hasattr(select, "epoll"):
+            self._poll = select.epoll()
+            self._events = select.EPOLLIN | select.EPOLLPRI
+            self._scale = 1
+        else:  # pragma: no cover
+            self._poll = select.poll()
+            self._events = select.POLLIN | select.POLLPRI
+            self._scale = 1000  # poll() expects milliseconds.
+
+    def register(self, fd):
+        self._poll.register(fd, self._events)
+
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+
+    def poll(self, timeout=None):
+        if timeout is None:
+            timeout = -1
+        else:
+            timeout *= self._scale
+        try:
+            return [fd for fd, _ in self._poll.poll(timeout)]
+        except (IOError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class EventLoop(threading.Thread):
+
+    """
+    Watches parked client connections, i.e. idle keep-alive clients that have been handed over by
+    their connection thread (see :py:class:`libmproxy.protocol.Park`). A single thread thereby takes
+    care of all idle clients, so that the number of threads (and thus memory usage) is bound by the
+    number of active connections only. Once a parked client sends data or closes the connection,
+    it is handed to ``resume`` again, which is expected to spawn a new thread for it.
+    """
+
+    def __init__(self, resume):
+        super(EventLoop, self).__init__(name="EventLoop")
+        self.daemon = True
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._parked = {}  # fd -> ConnectionHandler
+        self._new = []
+        self._should_exit = False
+        self._poller = _Poller()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._poller.register(self._wakeup_r)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._parked) + len(self._new)
+
+    def _wakeup(self):
+        os.write(self._wakeup_w, b"x")
+
+    def park(self, handler):
+        """
+        Watches the client connection of the given ConnectionHandler until it becomes readable.
+        """
+        with self._lock:
+            self._new.append(handler)
+        self._wakeup()
+
+    def run(self):
+        while not self._should_exit:
+            for fd in self._poller.poll():
+                if fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 4096)
+                    continue
+                self._poller.unregister(fd)
+                with self._lock:
+                    handler = self._parked.pop(fd)
+                self.resume(handler)
+            with self._lock:
+                new, self._new = self._new, []
+                for handler in new:
+                    fd = handler.client_conn.connection.fileno()
+                    self._parked[fd] = handler
+                    self._poller.register(fd)
+
+    def shutdown(self):
+        """
+        Stops the event loop and closes all parked client connections.
+        """
+        self._should_exit = True
+        self._wakeup()
+        if self.is_alive():
+            self.join()
+        with self._lock:
+            handlers = list(self._parked.values()) + self._new
+            self._parked.clear()
+            self._new = []
+        for handler in handlers:
+            tcp.close_socket(handler.client_conn.connection)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
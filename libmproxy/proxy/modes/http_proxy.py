@@ -5,6 +5,9 @@ from ...protocol import Layer, ServerConnectionMixin
 
 class HttpProxy(Layer, ServerConnectionMixin):
 
+    # A new instance can take over a parked client connection, see libmproxy.protocol.Park.
+    resumable = True
+
     def __call__(self):
         layer = self.ctx.next_layer(self)
         try:
@@ -16,6 +19,9 @@ class HttpProxy(Layer, ServerConnectionMixin):
 
 class HttpUpstreamProxy(Layer, ServerConnectionMixin):
 
+    # A new instance can take over a parked client connection, see libmproxy.protocol.Park.
+    resumable = True
+
     def __init__(self, ctx, server_address):
         super(HttpUpstreamProxy, self).__init__(ctx, server_address=server_address)
 
@@ -5,6 +5,9 @@ from ...protocol import Layer, ServerConnectionMixin
 
 class ReverseProxy(Layer, ServerConnectionMixin):
 
+    # A new instance can take over a parked client connection, see libmproxy.protocol.Park.
+    resumable = True
+
     def __init__(self, ctx, server_address, server_tls):
         super(ReverseProxy, self).__init__(ctx, server_address=server_address)
         self.server_tls = server_tls
@@ -7,6 +7,9 @@ from ...protocol import Layer, ServerConnectionMixin
 
 class TransparentProxy(Layer, ServerConnectionMixin):
 
+    # A new instance can take over a parked client connection, see libmproxy.protocol.Park.
+    resumable = True
+
     def __init__(self, ctx):
         super(TransparentProxy, self).__init__(ctx)
         self.resolver = platform.resolver()
@@ -0,0 +1,135 @@
+from __future__ import (absolute_import, print_function, division)
+
+import select
+import socket
+import threading
+import time
+
+from netlib import tcp
+from netlib.exceptions import NetlibException
+
+# Connection reuse across client connections is opt-in.
+DEFAULT_POOL_SIZE = 0
+DEFAULT_IDLE_TIMEOUT = 30
+
+
+class ConnectionPool(object):
+
+    """
+    A bounded pool of idle upstream connections, shared by all client connections.
+
+    Connections are identified by (address, TLS, SNI, ALPN, client certificate),
+    so that a connection is only handed out to a layer that would have
+    established exactly the same connection itself. Only connections that
+    have been marked with ``keep_alive`` after a complete HTTP/1 exchange are
+    accepted, and never connections that have carried connection-based
+    authentication (NTLM, Negotiate), which binds them to a single client. Idle connections are evicted after ``idle_timeout`` seconds or
+    when the pool is full, and dropped if the server has closed them in the
+    meantime.
+    """
+
+    def __init__(self, size, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = []  # (timestamp, key, connection), oldest first
+
+    def __len__(self):
+        return len(self._idle)
+
+    @staticmethod
+    def _key(address, tls, sni, alpn_protos, clientcerts):
+        return (
+            tcp.Address.wrap(address),
+            bool(tls),
+            sni if tls else None,
+            tuple(alpn_protos) if tls and alpn_protos else None,
+            clientcerts if tls else None,
+        )
+
+    @staticmethod
+    def _is_alive(conn):
+        """
+        An idle connection must not be readable: there either is unexpected
+        data from the server or, more likely, the server has closed it.
+        """
+        try:
+            return not tcp.ssl_read_select([conn.connection], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.finish()
+            conn.close()
+        except (NetlibException, socket.error):
+            pass
+
+    def _evict_expired(self):
+        """
+        Must be called with the lock held. Returns the evicted connections.
+        """
+        deadline = time.time() - self.idle_timeout
+        i = 0
+        while i < len(self._idle) and self._idle[i][0] < deadline:
+            i += 1
+        evicted = [conn for _, _, conn in self._idle[:i]]
+        del self._idle[:i]
+        return evicted
+
+    def get(self, address, tls=False, sni=None, alpn_protos=None, clientcerts=None):
+        """
+        Returns an idle connection with the given parameters, or None.
+        """
+        if not self.size:
+            return None
+        key = self._key(address, tls, sni, alpn_protos, clientcerts)
+        found = None
+        with self._lock:
+            stale = self._evict_expired()
+            # Prefer the most recently used connection, it is the least likely to be closed.
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][1] == key:
+                    found = self._idle.pop(i)[2]
+                    break
+        for conn in stale:
+            self._close(conn)
+        if found and not self._is_alive(found):
+            self._close(found)
+            return self.get(address, tls, sni, alpn_protos, clientcerts)
+        if found:
+            found.keep_alive = False
+        return found
+
+    def put(self, conn):
+        """
+        Hands over an idle connection to the pool.
+
+        Returns:
+            True, if the connection has been added to the pool.
+            False, if it is not reusable, in which case the caller remains responsible for closing it.
+        """
+        if not (self.size and conn and conn.keep_alive):
+            return False
+        if conn.connection_auth or not self._is_alive(conn):
+            return False
+        key = self._key(conn.address, conn.tls_established, conn.sni, conn.alpn_protos, conn.clientcerts)
+        with self._lock:
+            stale = self._evict_expired()
+            self._idle.append((time.time(), key, conn))
+            if len(self._idle) > self.size:
+                stale.extend(c for _, _, c in self._idle[:-self.size])
+                del self._idle[:-self.size]
+        for c in stale:
+            self._close(c)
+        return True
+
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, _, conn in idle:
+            self._close(conn)
@@ -3,16 +3,18 @@ from __future__ import (absolute_import, print_function, division)
 import traceback
 import sys
 import socket
+import threading
 import six
 
 from netlib import tcp
 from netlib.exceptions import TcpException
 from netlib.http.http1 import assemble_response
 from ..exceptions import ProtocolException, ServerException, ClientHandshakeException
-from ..protocol import Kill
+from ..protocol import Kill, Park
 from ..models import ClientConnection, make_error_response
 from .modes import HttpUpstreamProxy, HttpProxy, ReverseProxy, TransparentProxy, Socks5Proxy
 from .root_context import RootContext, Log
+from .event_loop import EventLoop
 
 
 class DummyServer:
@@ -45,7 +47,25 @@ class ProxyServer(tcp.TCPServer):
                 ServerException('Error starting proxy server: ' + repr(e)),
                 sys.exc_info()[2]
             )
+        if config.thread_stack_size:
+            # netlib's TCPServer spawns one thread per client connection.
+            # The stack size applies to all threads started from now on,
+            # which is what dominates memory usage with many idle clients.
+            try:
+                threading.stack_size(config.thread_stack_size)
+            except (ValueError, threading.ThreadError) as e:
+                six.reraise(
+                    ServerException,
+                    ServerException('Error setting thread stack size: ' + repr(e)),
+                    sys.exc_info()[2]
+                )
         self.channel = None
+        self.event_loop = None
+        if config.event_loop:
+            self.event_loop = EventLoop(self.resume)
+            self.event_loop.start()
+        if config.cert_prewarm:
+            config.certstore.prewarm(config.cert_prewarm)
 
     def start_slave(self, klass, channel):
         slave = klass(channel, self)
@@ -54,14 +74,70 @@ class ProxyServer(tcp.TCPServer):
     def set_channel(self, channel):
         self.channel = channel
 
+    def shutdown(self):
+        super(ProxyServer, self).shutdown()
+        if self.event_loop:
+            self.event_loop.shutdown()
+        self.config.connection_pool.clear()
+
+    def connection_thread(self, connection, client_address):
+        # Unlike netlib's implementation, this keeps the socket open if the connection has been parked.
+        client_address = tcp.Address(client_address)
+        parked = False
+        try:
+            parked = self.handle_client_connection(connection, client_address)
+        except:
+            self.handle_error(connection, client_address)
+        finally:
+            if not parked:
+                tcp.close_socket(connection)
+
     def handle_client_connection(self, conn, client_address):
+        """
+        Returns:
+            True, if the connection has been parked in the event loop.
+        """
         h = ConnectionHandler(
             conn,
             client_address,
             self.config,
             self.channel
         )
-        h.handle()
+        return self.handle_connection(h)
+
+    def handle_connection(self, handler):
+        parked = handler.handle()
+        if parked:
+            self.event_loop.park(handler)
+        return parked
+
+    def resume(self, handler):
+        """
+        Called by the event loop if a parked client connection becomes readable again.
+        """
+        address = handler.client_conn.address
+        t = threading.Thread(
+            target=self.resumed_connection_thread,
+            args=(handler,),
+            name="ConnectionThread (%s:%s -> %s:%s, resumed)" %
+                 (address.host, address.port, self.address.host, self.address.port)
+        )
+        t.daemon = True
+        try:
+            t.start()
+        except threading.ThreadError:
+            self.handle_error(handler.client_conn.connection, address)
+            tcp.close_socket(handler.client_conn.connection)
+
+    def resumed_connection_thread(self, handler):
+        parked = False
+        try:
+            parked = self.handle_connection(handler)
+        except:
+            self.handle_error(handler.client_conn.connection, handler.client_conn.address)
+        finally:
+            if not parked:
+                tcp.close_socket(handler.client_conn.connection)
 
 
 class ConnectionHandler(object):
@@ -76,6 +152,8 @@ class ConnectionHandler(object):
         """@type: libmproxy.proxy.connection.ClientConnection"""
         self.channel = channel
         """@type: libmproxy.controller.Channel"""
+        self.resumed = False
+        "True if the connection has been parked before and a new root layer takes over."
 
     def _create_root_layer(self):
         root_context = RootContext(
@@ -109,16 +187,28 @@ class ConnectionHandler(object):
             raise ValueError("Unknown proxy mode: %s" % mode)
 
     def handle(self):
-        self.log("clientconnect", "info")
+        """
+        Returns:
+            True, if the client connection has been parked (see :py:class:`~libmproxy.protocol.Park`).
+            The connection must then be kept open and this method be called again once the
+            client sends more data.
+        """
+        if not self.resumed:
+            self.log("clientconnect", "info")
 
         root_layer = self._create_root_layer()
-        root_layer = self.channel.ask("clientconnect", root_layer)
-        if root_layer == Kill:
-            def root_layer():
-                raise Kill()
+        if not self.resumed:
+            root_layer = self.channel.ask("clientconnect", root_layer)
+            if root_layer == Kill:
+                def root_layer():
+                    raise Kill()
 
         try:
             root_layer()
+        except Park:
+            self.log("idle, handing over to event loop", "debug")
+            self.resumed = True
+            return True
         except Kill:
             self.log("Connection killed", "info")
         except ProtocolException as e:
@@ -151,6 +241,7 @@ class ConnectionHandler(object):
         self.log("clientdisconnect", "info")
         self.channel.tell("clientdisconnect", root_layer)
         self.client_conn.finish()
+        return False
 
     def log(self, msg, level):
         msg = "{}: {}".format(repr(self.client_conn.address), msg)
@@ -0,0 +1,197 @@
+from __future__ import (absolute_import, print_function, division)
+
+import collections
+import threading
+import time
+
+from netlib import tcp
+from ..models.connections import TLS_SESSION_RESUMPTION
+
+DEFAULT_CACHE_SIZE = 1000
+# OpenSSL's default session timeout.
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CONTEXT_CACHE_SIZE = 100
+
+CachedSession = collections.namedtuple("CachedSession", ["session", "verification_error"])
+
+
+class TlsSessionCache(object):
+
+    """
+    A process-wide cache of TLS sessions for upstream connections, so that
+    new connections to the same server can resume a previous session instead
+    of doing a full handshake.
+
+    Sessions are keyed by (server address, SNI, client certificate) and expire
+    after ``ttl`` seconds. If the cache is full, the least recently stored
+    session is dropped. A resumed handshake does not verify the server
+    certificate again, so the verification result of the original handshake
+    is kept alongside the session.
+
+    If pyOpenSSL does not support session resumption, the cache stays empty.
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def _key(address, sni, clientcert):
+        return tcp.Address.wrap(address), sni, clientcert
+
+    def get(self, address, sni, clientcert=None):
+        """
+        Returns:
+            A :py:class:`CachedSession` to resume, or None.
+        """
+        if not (self.size and TLS_SESSION_RESUMPTION):
+            return None
+        key = self._key(address, sni, clientcert)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry and entry[0] < time.time() - self.ttl:
+                del self._sessions[key]
+                entry = None
+        return entry[1] if entry else None
+
+    def put(self, address, sni, clientcert, session, verification_error=None):
+        if not (self.size and TLS_SESSION_RESUMPTION) or session is None:
+            return
+        key = self._key(address, sni, clientcert)
+        with self._lock:
+            self._sessions.pop(key, None)
+            self._sessions[key] = (time.time(), CachedSession(session, verification_error))
+            while len(self._sessions) > self.size:
+                self._sessions.popitem(last=False)
+
+    def discard(self, address, sni, clientcert=None):
+        with self._lock:
+            self._sessions.pop(self._key(address, sni, clientcert), None)
+
+    def handshake_done(self, conn, clientcert, cached=None):
+        """
+        Updates the statistics and remembers the session after a handshake
+        with the given ServerConnection.
+
+        Args:
+            cached: The :py:class:`CachedSession` that has been offered for resumption, if any.
+        """
+        resumed = cached is not None and conn.tls_session_reused()
+        with self._lock:
+            if resumed:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if resumed:
+            conn.ssl_verification_error = cached.verification_error
+        self.store(conn, clientcert)
+
+    def store(self, conn, clientcert):
+        """
+        Remembers the current session of an established ServerConnection.
+        With TLS 1.3, the session ticket only arrives after the handshake,
+        so this should be called again before the connection is closed.
+        """
+        self.put(conn.address, conn.sni, clientcert, conn.get_tls_session(), conn.ssl_verification_error)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def get_state(self):
+        return dict(
+            size=len(self._sessions),
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+    def summary(self):
+        state = self.get_state()
+        total = state["hits"] + state["misses"]
+        return "{} sessions, {} resumed of {} handshakes ({:.0%})".format(
+            state["size"],
+            state["hits"],
+            total,
+            state["hits"] / total if total else 0
+        )
+
+
+class TlsContextCache(object):
+
+    """
+    Shares SSL contexts between client connections that are set up in the same way, i.e. with
+    the same interception certificate, TLS method, options, ciphers and ALPN choice.
+
+    OpenSSL keeps the server-side session cache and the session ticket keys per context, so a
+    client can only resume its session with the proxy if it gets the same context again. As a
+    bonus, we do not need to set up a new context for every connection. If the cache is full,
+    the least recently used context is dropped.
+    """
+
+    def __init__(self, size=DEFAULT_CONTEXT_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._contexts = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.resumed = 0
+
+    def __len__(self):
+        return len(self._contexts)
+
+    def get(self, key, create):
+        """
+        Returns the context for the given key, or a new one created by calling create().
+        """
+        if not self.size:
+            return create()
+        with self._lock:
+            context = self._contexts.pop(key, None)
+            if context is not None:
+                self._contexts[key] = context
+                self.hits += 1
+                return context
+            self.misses += 1
+        context = create()
+        with self._lock:
+            self._contexts[key] = context
+            while len(self._contexts) > self.size:
+                self._contexts.popitem(last=False)
+        return context
+
+    def handshake_done(self, conn):
+        """
+        Updates the statistics after a handshake with the given ClientConnection.
+        """
+        if conn.tls_session_reused():
+            with self._lock:
+                self.resumed += 1
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+
+    def get_state(self):
+        return dict(
+            size=len(self._contexts),
+            hits=self.hits,
+            misses=self.misses,
+            resumed=self.resumed,
+        )
+
+    def summary(self):
+        state = self.get_state()
+        total = state["hits"] + state["misses"]
+        return "{} contexts, {} resumed of {} handshakes ({:.0%})".format(
+            state["size"],
+            state["resumed"],
+            total,
+            state["resumed"] / total if total else 0
+        )
@@ -38,8 +38,10 @@ class ScriptContext(object):
         etc.
         """
         self._master.pause_scripts = True
+        self._master.invalidate_subscriptions()
         f = self._master.duplicate_flow(f)
         self._master.pause_scripts = False
+        self._master.invalidate_subscriptions()
         return f
 
     def replay_request(self, f):
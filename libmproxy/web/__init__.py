@@ -155,7 +155,12 @@ class WebMaster(flow.FlowMaster):
     def run(self):  # pragma: no cover
         self.server.start_slave(
             controller.Slave,
-            controller.Channel(self.masterq, self.should_exit)
+            controller.Channel(
+                self.masterq,
+                self.should_exit,
+                self.hook_stats,
+                self.subscribed
+            )
         )
         iol = tornado.ioloop.IOLoop.instance()
 
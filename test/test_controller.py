@@ -1,3 +1,6 @@
+import Queue
+import threading
+
 import mock
 from libmproxy import controller
 
@@ -9,3 +12,121 @@ class TestMaster:
         msg = mock.MagicMock()
         m.handle("type", msg)
         assert msg.reply.call_count == 1
+
+    def test_tick_batch(self):
+        m = controller.Master(None)
+        m.handle = mock.Mock()
+        assert not m.tick(m.masterq, 0)
+        for i in range(3):
+            m.masterq.put(("type", i))
+        assert m.tick(m.masterq, 0)
+        assert m.handle.call_count == 3
+        assert m.masterq.empty()
+
+    def test_shutdown_aborts_pending(self):
+        m = controller.Master(None)
+        m.handle_foo = lambda obj: None
+        channel = controller.Channel(m.masterq, m.should_exit)
+        queued, handled = mock.Mock(), mock.Mock()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda o=o: results.append(channel.ask("foo", o)))
+            for o in (handled, queued)
+        ]
+        threads[0].start()
+        m.handle(*m.masterq.get())  # handled, but never replied to.
+        threads[1].start()
+        with m.masterq.not_empty:
+            while not m.masterq.queue:
+                m.masterq.not_empty.wait()
+        m.shutdown()
+        for t in threads:
+            t.join(1)
+            assert not t.is_alive()
+        assert results == [None, None]
+        assert channel.ask("foo", mock.Mock()) is None
+
+
+class TestChannel:
+
+    def _ask(self, channel, m):
+        result = []
+        t = threading.Thread(target=lambda: result.append(channel.ask("foo", m)))
+        t.start()
+        return t, result
+
+    def test_ask(self):
+        q = Queue.Queue()
+        stats = controller.HookStats()
+        channel = controller.Channel(q, threading.Event(), stats)
+        m = mock.Mock()
+
+        t, result = self._ask(channel, m)
+        mtype, obj = q.get()
+        assert mtype == "foo"
+        obj.reply()
+        t.join()
+        assert result == [m]
+        assert stats.get_state()["foo"]["count"] == 1
+
+        t, result = self._ask(channel, m)
+        _, obj = q.get()
+        obj.reply(42)
+        obj.reply(43)
+        t.join()
+        assert result == [42]
+        assert stats.get_state()["foo"]["count"] == 2
+
+    def test_unsubscribed(self):
+        q = Queue.Queue()
+        channel = controller.Channel(
+            q,
+            threading.Event(),
+            subscribed=lambda mtype, m: mtype == "foo"
+        )
+        m = mock.Mock()
+        assert channel.ask("bar", m) is m
+        assert m.reply.acked is False
+        channel.tell("bar", m)
+        assert q.empty()
+        channel.tell("foo", m)
+        assert q.get() == ("foo", m)
+
+    def test_tell(self):
+        q = Queue.Queue()
+        channel = controller.Channel(q, threading.Event())
+        m = mock.Mock()
+        channel.tell("foo", m)
+        assert q.get() == ("foo", m)
+        m.reply()
+        assert m.reply.acked
+
+
+class TestReply:
+
+    def test_abort(self):
+        r = controller.Reply(42)
+        r.abort()
+        r.abort()
+        assert r.wait() is None
+        r()
+        assert r.value is None
+
+
+class TestHookStats:
+
+    def test_simple(self):
+        s = controller.HookStats()
+        assert s.summary() == []
+        s.add("request", 0.1)
+        s.add("request", 0.3)
+        s.add("response", 0.001)
+        state = s.get_state()
+        assert state["request"]["count"] == 2
+        assert state["request"]["max"] == 0.3
+        assert abs(state["request"]["avg"] - 0.2) < 0.0001
+        summary = s.summary()
+        assert summary[0].startswith("request: 2 calls")
+        s.clear()
+        assert s.get_state() == {}
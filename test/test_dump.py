@@ -234,6 +234,33 @@ class TestDumpMaster:
             self._dummy_cycle, 1, None, "", scripts=["starterr.py"]
         )
 
+    def test_subscriptions(self):
+        m = dump.DumpMaster(None, dump.Options(flow_detail=0, verbosity=1))
+        assert m.subscriptions() == set(["log"])
+        assert m.subscribed("log", Log("foo", "info"))
+        assert not m.subscribed("log", Log("foo", "debug"))
+        assert not m.subscribed("request", tutils.tflow())
+
+        # A flow whose request has been skipped must not break the response.
+        f = tutils.tflow(resp=True)
+        f.reply = mock.MagicMock()
+        assert m.handle_response(f)
+
+        m.anticomp = True
+        assert m.subscriptions() == set(["log", "request", "response", "error"])
+        assert not m.subscribed("request", tutils.tflow())
+        m.invalidate_subscriptions()
+        assert m.subscribed("request", tutils.tflow())
+
+        m = dump.DumpMaster(None, dump.Options(flow_detail=0, verbosity=1))
+        m.setheaders.add("~q", "foo", "bar")
+        assert m.subscribed("request", tutils.tflow())
+        m.setheaders.clear()
+        assert not m.subscribed("request", tutils.tflow())
+
+        m = dump.DumpMaster(None, dump.Options(flow_detail=1))
+        assert "response" in m.subscriptions()
+
     def test_stickycookie(self):
         self._dummy_cycle(1, None, "", stickycookie = ".*")
 
@@ -735,6 +735,44 @@ class TestFlowMaster:
             tutils.test_data.path("scripts/starterr.py"))
         assert len(fm.scripts) == 0
 
+    def test_subscriptions(self):
+        fm = flow.FlowMaster(None, flow.State())
+        assert fm.hook_subscriptions() == set()
+        assert fm.subscriptions() == set(["log", "request", "response", "error"])
+        assert not fm.subscribed("clientconnect", None)
+        assert fm.subscribed("request", tutils.tflow())
+
+        fm.load_script(tutils.test_data.path("scripts/all.py"))
+        assert "clientconnect" in fm.hook_subscriptions()
+        assert fm.subscribed("clientconnect", None)
+        fm.pause_scripts = True
+        assert fm.hook_subscriptions() == set()
+        fm.pause_scripts = False
+        fm.unload_scripts()
+        assert not fm.subscribed("clientconnect", None)
+
+        fm.anticache = True
+        assert fm.hook_subscriptions() == set(["request"])
+        fm.anticache = False
+        fm.set_stream_large_bodies(1024)
+        assert fm.hook_subscriptions() == set(["responseheaders"])
+        assert fm.subscribed("responseheaders", None)
+        fm.set_stream_large_bodies(None)
+        assert not fm.subscribed("responseheaders", None)
+
+        # The set is cached, so plain attribute changes need an explicit invalidation.
+        fm.stream_large_bodies = flow.StreamLargeBodies(1024)
+        assert not fm.subscribed("responseheaders", None)
+        fm.invalidate_subscriptions()
+        assert fm.subscribed("responseheaders", None)
+
+        class Sub(flow.FlowMaster):
+            def handle_clientconnect(self, root_layer):
+                pass
+        fm = Sub(None, flow.State())
+        assert fm.overridden_handlers(flow.FlowMaster) == set(["clientconnect"])
+        assert fm.subscribed("clientconnect", None)
+
     def test_getset_ignore(self):
         p = mock.Mock()
         p.config.check_ignore = HostMatcher()
@@ -0,0 +1,40 @@
+import os
+import socket
+from unittest.case import SkipTest
+
+from libmproxy import platform
+
+
+class TestSplicer:
+
+    def setup(self):
+        if not platform.splicer:
+            raise SkipTest("splice() is not available.")
+
+    def test_transfer(self):
+        a, b = socket.socketpair()
+        c, d = socket.socketpair()
+        s = platform.splicer()
+        try:
+            data = os.urandom(100000)
+            b.sendall(data[:50000])
+            assert s.transfer(a, c) == 50000
+            assert d.recv(65536) == data[:50000]
+
+            b.sendall(data[50000:])
+            received = b""
+            while len(received) < 50000:
+                assert s.transfer(a, c) > 0
+                received += d.recv(65536)
+            assert received == data[50000:]
+
+            # Nothing to read.
+            a.setblocking(False)
+            assert s.transfer(a, c) is None
+
+            b.close()
+            assert s.transfer(a, c) == 0
+        finally:
+            s.close()
+            for sock in (a, c, d):
+                sock.close()
@@ -0,0 +1,155 @@
+import threading
+
+from netlib import tcp
+from netlib.http import Headers
+from netlib.http.http2.connections import HTTP2Protocol
+from netlib.http.http2.frame import DataFrame, HeadersFrame, Frame
+from libmproxy import flow
+import tservers
+
+
+class _Http2Client(object):
+
+    """
+    A minimal HTTP/2 client that sends requests on streams of its own choosing
+    and reads the responses in whatever order they arrive.
+    """
+
+    def __init__(self, port):
+        self.conn = tcp.TCPClient(("127.0.0.1", port))
+        self.conn.connect()
+        self.conn.convert_to_ssl(alpn_protos=[b"h2"])
+        assert self.conn.get_alpn_proto_negotiated() == b"h2"
+        self.protocol = HTTP2Protocol(self.conn)
+        self.protocol.perform_connection_preface()
+        self.headers = {}
+        self.bodies = {}
+        self.finished = []
+
+    def request(self, stream_id, path, body=b""):
+        headers = Headers([
+            [b":method", b"POST" if body else b"GET"],
+            [b":scheme", b"https"],
+            [b":authority", b"127.0.0.1"],
+            [b":path", path],
+        ])
+        self.conn.wfile.write(b"".join(self.protocol._create_headers(headers, stream_id, not body)))
+        self.conn.wfile.write(b"".join(self.protocol._create_body(body, stream_id)))
+        self.conn.wfile.flush()
+
+    def read_response(self):
+        """
+        Reads frames until a stream has been finished, and returns its id.
+        """
+        while True:
+            frm = self.protocol.read_frame()
+            if isinstance(frm, HeadersFrame):
+                self.headers[frm.stream_id] = dict(self.protocol.decoder.decode(frm.header_block_fragment))
+                self.bodies[frm.stream_id] = b""
+            elif isinstance(frm, DataFrame):
+                self.bodies[frm.stream_id] += frm.payload
+            else:
+                continue
+            if frm.flags & Frame.FLAG_END_STREAM:
+                self.finished.append(frm.stream_id)
+                return frm.stream_id
+
+
+class Http2ProxTest(tservers.ReverseProxTest):
+    ssl = True
+
+    @classmethod
+    def get_proxy_config(cls):
+        d = tservers.ReverseProxTest.get_proxy_config.im_func(cls)
+        d["http2"] = True
+        return d
+
+    def setup(self):
+        tservers.ReverseProxTest.setup(self)
+        self.clients = []
+
+    def teardown(self):
+        for c in self.clients:
+            c.conn.close()
+
+    def client(self):
+        c = _Http2Client(self.proxy.port)
+        self.clients.append(c)
+        return c
+
+
+class TestHttp2(Http2ProxTest):
+
+    def test_simple(self):
+        c = self.client()
+        c.request(1, b"/p/200:b@10")
+        assert c.read_response() == 1
+        assert c.headers[1][":status"] == "200"
+        assert len(c.bodies[1]) == 10
+        c.request(3, b"/p/201")
+        assert c.read_response() == 3
+        assert c.headers[3][":status"] == "201"
+        assert len(self.master.state.flows) == 2
+        assert self.master.state.flows[0].request.http_version == "HTTP/2.0"
+
+    def test_many_streams(self):
+        # pathod only allows one concurrent stream, so we have to queue them upstream.
+        c = self.client()
+        for i in range(10):
+            c.request(2 * i + 1, b"/p/200:b@%d" % (i + 1))
+        for _ in range(10):
+            c.read_response()
+        assert sorted(c.finished) == [2 * i + 1 for i in range(10)]
+        assert all(len(c.bodies[2 * i + 1]) == i + 1 for i in range(10))
+
+    def test_request_body(self):
+        c = self.client()
+        c.request(1, b"/p/200", body=b"x" * 100000)
+        assert c.read_response() == 1
+        assert self.master.state.flows[0].request.content == b"x" * 100000
+
+    def test_flow_control(self):
+        # Larger than the initial flow-control windows.
+        c = self.client()
+        c.request(1, b"/p/200:b@200k")
+        assert c.read_response() == 1
+        assert len(c.bodies[1]) == 200 * 1024
+
+
+class HoldingMaster(tservers.TestMaster):
+
+    """
+    Holds requests whose path contains "hold" until a response to another request has been sent.
+    """
+
+    def __init__(self, config):
+        tservers.TestMaster.__init__(self, config)
+        self.released = threading.Event()
+
+    def handle_request(self, f):
+        flow.FlowMaster.handle_request(self, f)
+        if "hold" in f.request.path:
+            def reply():
+                self.released.wait(5)
+                f.reply()
+            threading.Thread(target=reply).start()
+        else:
+            f.reply()
+
+    def handle_response(self, f):
+        tservers.TestMaster.handle_response(self, f)
+        self.released.set()
+
+
+class TestHttp2Multiplexing(Http2ProxTest):
+    masterclass = HoldingMaster
+
+    def test_concurrent_streams(self):
+        c = self.client()
+        c.request(1, b"/p/200:b@10:h'x'='hold'")
+        c.request(3, b"/p/201:b@10")
+        # The first stream does not block the second one.
+        assert c.read_response() == 3
+        assert c.read_response() == 1
+        assert c.headers[1][":status"] == "200"
+        assert c.headers[3][":status"] == "201"
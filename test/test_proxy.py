@@ -1,18 +1,253 @@
 import os
+import socket
+import time
 import mock
 from OpenSSL import SSL
 
-from libmproxy import cmdline
+from libmproxy import cmdline, flow
 from libmproxy.proxy import ProxyConfig
+from libmproxy.proxy.certstore import CertStore, cert_params, prewarm_items
 from libmproxy.proxy.config import process_proxy_options
+from libmproxy.proxy.pool import ConnectionPool
+from libmproxy.proxy.session_cache import TlsSessionCache, TlsContextCache
 from libmproxy.models.connections import ServerConnection
 from libmproxy.proxy.server import DummyServer, ProxyServer, ConnectionHandler
+from netlib import tcp
 from netlib.exceptions import TcpDisconnect
 import tutils
 from libpathod import test
 from netlib.http import http1
 
 
+class TestConnectionPool(object):
+
+    def _conn(self, address=("example.com", 80)):
+        a, b = socket.socketpair()
+        conn = ServerConnection(address)
+        conn.connection = a
+        conn.rfile = tcp.Reader(a.makefile("rb", -1))
+        conn.wfile = tcp.Writer(a.makefile("wb", -1))
+        conn.keep_alive = True
+        return conn, b
+
+    def test_simple(self):
+        pool = ConnectionPool(10)
+        conn, _ = self._conn()
+        assert not pool.get(("example.com", 80))
+        assert pool.put(conn)
+        assert len(pool) == 1
+        assert not pool.get(("example.com", 81))
+        assert not pool.get(("example.com", 80), tls=True, sni="example.com")
+        assert pool.get(("example.com", 80)) is conn
+        assert not conn.keep_alive
+        assert len(pool) == 0
+
+    def test_not_reusable(self):
+        pool = ConnectionPool(10)
+        conn, _ = self._conn()
+        conn.keep_alive = False
+        assert not pool.put(conn)
+        conn, _ = self._conn()
+        assert not ConnectionPool(size=0).put(conn)
+        conn, _ = self._conn()
+        conn.connection_auth = True
+        assert not pool.put(conn)
+
+        # The server has closed the connection.
+        conn, peer = self._conn()
+        peer.close()
+        assert not pool.put(conn)
+        conn, peer = self._conn()
+        assert pool.put(conn)
+        peer.close()
+        assert not pool.get(("example.com", 80))
+
+    def test_eviction(self):
+        pool = ConnectionPool(size=2)
+        conns, peers = zip(*[self._conn() for _ in range(3)])
+        for conn in conns:
+            assert pool.put(conn)
+        assert len(pool) == 2
+        assert conns[0].finished
+
+        pool.idle_timeout = 0
+        time.sleep(0.01)
+        assert not pool.get(("example.com", 80))
+        assert len(pool) == 0
+        assert conns[1].finished
+
+    def test_clear(self):
+        pool = ConnectionPool(10)
+        conn, _ = self._conn()
+        pool.put(conn)
+        pool.clear()
+        assert len(pool) == 0
+        assert conn.finished
+
+
+class TestTlsSessionCache(object):
+
+    def test_simple(self):
+        c = TlsSessionCache()
+        assert not c.get(("example.com", 443), "example.com")
+        c.put(("example.com", 443), "example.com", None, "session", {"errno": 18})
+        assert len(c) == 1
+        assert not c.get(("example.com", 443), "example.org")
+        assert not c.get(("example.com", 443), "example.com", "client.pem")
+        cached = c.get(("example.com", 443), "example.com")
+        assert cached.session == "session"
+        assert cached.verification_error == {"errno": 18}
+        c.discard(("example.com", 443), "example.com")
+        assert len(c) == 0
+
+    def test_limits(self):
+        c = TlsSessionCache(size=2)
+        for i in range(3):
+            c.put(("example.com", 443), str(i), None, "session")
+        assert len(c) == 2
+        assert not c.get(("example.com", 443), "0")
+
+        c.ttl = 0
+        time.sleep(0.01)
+        assert not c.get(("example.com", 443), "1")
+        assert len(c) == 1
+
+        c = TlsSessionCache(size=0)
+        c.put(("example.com", 443), "example.com", None, "session")
+        assert not c.get(("example.com", 443), "example.com")
+
+    @mock.patch("libmproxy.proxy.session_cache.TLS_SESSION_RESUMPTION", False)
+    def test_unsupported(self):
+        c = TlsSessionCache()
+        c.put(("example.com", 443), "example.com", None, "session")
+        assert not c.get(("example.com", 443), "example.com")
+
+    def test_stats(self):
+        c = TlsSessionCache()
+        assert c.summary() == "0 sessions, 0 resumed of 0 handshakes (0%)"
+        conn = mock.Mock(address=("example.com", 443), sni="example.com", ssl_verification_error=None)
+        conn.get_tls_session.return_value = "session"
+        c.handshake_done(conn, None)
+        cached = c.get(("example.com", 443), "example.com")
+        assert cached.session == "session"
+
+        conn.tls_session_reused.return_value = True
+        c.handshake_done(conn, None, cached)
+        assert c.get_state() == dict(size=1, hits=1, misses=1)
+        assert c.summary() == "1 sessions, 1 resumed of 2 handshakes (50%)"
+
+        conn.get_tls_session.return_value = None
+        c.clear()
+        c.store(conn, None)
+        assert len(c) == 0
+
+
+class TestTlsContextCache(object):
+
+    def test_simple(self):
+        c = TlsContextCache(size=2)
+        assert c.get("a", lambda: "ctx-a") == "ctx-a"
+        assert c.get("a", lambda: "other") == "ctx-a"
+        assert c.get("b", lambda: "ctx-b") == "ctx-b"
+        # "a" is the most recently used one now.
+        assert c.get("a", lambda: "other") == "ctx-a"
+        assert c.get("c", lambda: "ctx-c") == "ctx-c"
+        assert len(c) == 2
+        assert c.get("b", lambda: "new-b") == "new-b"
+        assert c.get_state() == dict(size=2, hits=2, misses=4, resumed=0)
+
+        c = TlsContextCache(size=0)
+        assert c.get("a", lambda: "ctx-a") == "ctx-a"
+        assert c.get("a", lambda: "other") == "other"
+        assert len(c) == 0
+
+    def test_stats(self):
+        c = TlsContextCache()
+        assert c.summary() == "0 contexts, 0 resumed of 0 handshakes (0%)"
+        c.get("a", lambda: "ctx-a")
+        c.get("a", lambda: "ctx-a")
+        conn = mock.Mock()
+        conn.tls_session_reused.return_value = True
+        c.handshake_done(conn)
+        assert c.summary() == "1 contexts, 1 resumed of 2 handshakes (50%)"
+        c.clear()
+        assert len(c) == 0
+
+
+class TestCertStore(object):
+
+    def test_cert_params(self):
+        assert cert_params("foo.com") == ("foo.com", [])
+        assert cert_params("foo.com", None, ["b.com", None, "a.com"]) == ("foo.com", ["a.com", "b.com"])
+        upstream_cert = mock.Mock(cn="bar.com", altnames=["*.bar.com"])
+        assert cert_params("foo.com", upstream_cert) == ("bar.com", ["*.bar.com", "foo.com"])
+
+    def test_cache(self):
+        with tutils.tmpdir() as d:
+            s = CertStore.from_store(d, "mitmproxy", cache=True)
+            cert, _, _ = s.get_cert("foo.com", ["bar.com"])
+            assert s.get_cert("foo.com", ["bar.com"])[0] == cert
+            assert s.get_state()["minted"] == 1
+            assert s.get_state()["hits"] == 1
+            assert len(os.listdir(s.cache_dir)) == 1
+
+            s = CertStore.from_store(d, "mitmproxy", cache=True)
+            assert s.get_cert("foo.com", ["bar.com"])[0].digest("sha256") == cert.digest("sha256")
+            assert s.get_state()["minted"] == 0
+            assert s.get_state()["disk_hits"] == 1
+
+            # Certificates from another CA are never loaded.
+            s = CertStore.from_store(os.path.join(d, "other"), "mitmproxy", cache=True)
+            s.get_cert("foo.com", ["bar.com"])
+            assert s.get_state()["minted"] == 1
+
+    def test_no_cache(self):
+        with tutils.tmpdir() as d:
+            s = CertStore.from_store(d, "mitmproxy")
+            assert not s.cache_dir
+            s.get_cert("foo.com", [])
+            assert not os.path.exists(os.path.join(d, "mitmproxy-certs"))
+
+    def test_prewarm(self):
+        with tutils.tmpdir() as d:
+            s = CertStore.from_store(d, "mitmproxy")
+
+            def fail():
+                raise ValueError()
+            items = [lambda: ("foo.com", ["bar.com"]), fail, lambda: ("foo.com", ["bar.com"])]
+            for t in s.prewarm(items, threads=2):
+                t.join()
+            assert s.get_state()["prewarmed"] == 1
+            assert s.get_state()["minted"] == 1
+            s.get_cert("foo.com", ["bar.com"])
+            assert s.get_state()["hits"] == 1
+            assert s.get_state()["minted"] == 1
+            assert "1 prewarmed, 1 generated" in s.summary()
+            assert s.prewarm([]) == []
+
+    def test_prewarm_items(self):
+        with tutils.tmpdir() as d:
+            path = os.path.join(d, "hosts")
+            with open(path, "wb") as f:
+                f.write(b"# comment\nfoo.com\n\nbar.com:8443\n")
+            items = prewarm_items(path, use_upstream_cert=False)
+            assert [i() for i in items] == [("foo.com", ["foo.com"]), ("bar.com", ["bar.com"])]
+
+            f = tutils.tflow(resp=True)
+            f.client_conn.ssl_established = True
+            f.server_conn.sni = "foo.com"
+            with open(path, "wb") as fp:
+                flow.FlowWriter(fp).add(f)
+                flow.FlowWriter(fp).add(tutils.tflow(resp=True))
+            items = prewarm_items(path)
+            assert [i() for i in items] == [("address", ["foo.com"])]
+
+            with open(path, "wb") as f:
+                f.write(b"5:foo")
+            tutils.raises(ValueError, prewarm_items, path)
+            tutils.raises(IOError, prewarm_items, os.path.join(d, "nonexistent"))
+
+
 class TestServerConnection(object):
 
     def test_simple(self):
@@ -149,6 +384,57 @@ class TestProcessProxyOptions:
         p = self.assert_noerr("--upstream-trusted-ca", expected_file)
         assert p.openssl_trusted_ca_server == expected_file
 
+    def test_thread_stack_size(self):
+        p = self.assert_noerr()
+        assert p.thread_stack_size is None
+        p = self.assert_noerr("--thread-stack-size", "256k")
+        assert p.thread_stack_size == 256 * 1024
+        self.assert_err("at least", "--thread-stack-size", "1k")
+
+    def test_event_loop(self):
+        assert not self.assert_noerr().event_loop
+        assert self.assert_noerr("--event-loop").event_loop
+
+    def test_upstream_pool_size(self):
+        p = self.assert_noerr()
+        assert p.connection_pool.size == 0
+        p = self.assert_noerr("--upstream-pool-size", "10")
+        assert p.connection_pool.size == 10
+        p = self.assert_noerr("--upstream-pool-size", "0")
+        assert p.connection_pool.size == 0
+        self.assert_err("negative", "--upstream-pool-size", "-1")
+
+    def test_tls_session_cache(self):
+        p = self.assert_noerr()
+        assert p.tls_session_cache.size == 1000
+        assert p.tls_session_cache.ttl == 300
+        p = self.assert_noerr(
+            "--upstream-tls-session-cache", "0",
+            "--upstream-tls-session-ttl", "60"
+        )
+        assert p.tls_session_cache.size == 0
+        assert p.tls_session_cache.ttl == 60
+        self.assert_err("negative", "--upstream-tls-session-cache", "-1")
+        self.assert_err("positive", "--upstream-tls-session-ttl", "0")
+
+
+    def test_cert_cache(self):
+        with tutils.tmpdir() as cadir:
+            p = self.assert_noerr("--cadir", cadir)
+            assert not p.certstore.cache_dir
+            assert not p.cert_prewarm
+            p = self.assert_noerr("--cadir", cadir, "--cert-cache")
+            assert p.certstore.cache_dir == os.path.join(cadir, "mitmproxy-certs")
+
+    def test_cert_prewarm(self):
+        with tutils.tmpdir() as d:
+            path = os.path.join(d, "hosts")
+            with open(path, "wb") as f:
+                f.write(b"foo.com\n")
+            p = self.assert_noerr("--cert-prewarm", path, "--no-upstream-cert")
+            assert [i() for i in p.cert_prewarm] == [("foo.com", ["foo.com"])]
+            self.assert_err("pre-warming", "--cert-prewarm", os.path.join(d, "nonexistent"))
+
 
 class TestProxyServer:
     # binding to 0.0.0.0:1 works without special permissions on Windows
@@ -166,6 +452,15 @@ class TestProxyServer:
         )
         tutils.raises("error starting proxy server", ProxyServer, conf)
 
+    @mock.patch("threading.stack_size")
+    def test_thread_stack_size(self, stack_size):
+        conf = ProxyConfig(port=0, thread_stack_size=256 * 1024)
+        ProxyServer(conf).socket.close()
+        stack_size.assert_called_once_with(256 * 1024)
+
+        stack_size.side_effect = ValueError("size not valid")
+        tutils.raises("error setting thread stack size", ProxyServer, conf)
+
 
 class TestDummyServer:
 
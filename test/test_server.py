@@ -1,6 +1,9 @@
+import contextlib
 import os
 import socket
+import threading
 import time
+import mock
 from OpenSSL import SSL
 from netlib.exceptions import HttpReadDisconnect, HttpException
 from netlib.tcp import Address
@@ -293,6 +296,132 @@ class TestHTTP(tservers.HTTPProxTest, CommonMixin, AppMixin):
         self.master.unload_scripts()
 
 
+class TestEventLoop(tservers.HTTPProxTest):
+
+    @classmethod
+    def get_proxy_config(cls):
+        d = tservers.HTTPProxTest.get_proxy_config()
+        d["event_loop"] = True
+        return d
+
+    def wait_for_parked(self, n):
+        event_loop = self.proxy.tmaster.server.event_loop
+        for _ in range(500):
+            if len(event_loop) == n:
+                return
+            time.sleep(0.01)
+        assert len(event_loop) == n
+
+    @mock.patch("libmproxy.protocol.http.PARK_DELAY", 0.01)
+    def test_park(self):
+        req = "get:'%s/p/200'" % self.server.urlbase
+        p = self.pathoc()
+        assert p.request(req).status_code == 200
+        self.wait_for_parked(1)
+
+        # The parked client connection is resumed by a new thread.
+        assert p.request(req).status_code == 200
+        assert p.request(req).status_code == 200
+        self.wait_for_parked(1)
+        flows = self.master.state.view[-3:]
+        assert flows[0].client_conn is flows[2].client_conn
+
+        p.close()
+        self.wait_for_parked(0)
+
+
+class TestConnectionPool(tservers.HTTPProxTest):
+
+    @classmethod
+    def get_proxy_config(cls):
+        d = tservers.HTTPProxTest.get_proxy_config()
+        d["upstream_pool_size"] = 10
+        return d
+
+    @contextlib.contextmanager
+    def pool_put(self):
+        """
+        Records whether the pool accepts the server connection that is offered to it within the
+        block, and waits until that has happened.
+        """
+        pool = self.config.connection_pool
+        done = threading.Event()
+        result = []
+
+        def put(conn):
+            result.append(put.original(conn))
+            done.set()
+            return result[-1]
+        put.original = pool.put
+
+        with mock.patch.object(pool, "put", side_effect=put):
+            yield result
+            assert done.wait(5)
+
+    def test_reuse(self):
+        pool = self.config.connection_pool
+        pool.clear()
+        req = "get:'%s/p/200:b@1'" % self.server.urlbase
+
+        with self.pool_put() as accepted:
+            p = self.pathoc()
+            assert p.request(req).status_code == 200
+            p.close()
+        assert accepted == [True]
+        assert len(pool) == 1
+
+        # A new client connection reuses the idle server connection.
+        with self.pool_put() as accepted:
+            p = self.pathoc()
+            assert p.request(req).status_code == 200
+            assert len(pool) == 0
+            first, second = self.master.state.view[-2:]
+            assert first.server_conn is second.server_conn
+
+            # Connections the server wants to close are not pooled.
+            assert p.request("get:'%s/p/200:b@1:h\"Connection\"=\"close\"'" % self.server.urlbase)
+            p.close()
+        assert accepted == [False]
+        assert len(pool) == 0
+
+    def test_connection_auth(self):
+        pool = self.config.connection_pool
+        pool.clear()
+
+        # NTLM authenticates the connection, which must not be handed to other clients.
+        with self.pool_put() as accepted:
+            p = self.pathoc()
+            assert p.request(
+                "get:'%s/p/401:b@1:h\"WWW-Authenticate\"=\"NTLM\"'" % self.server.urlbase
+            ).status_code == 401
+            assert p.request(
+                "get:'%s/p/200:b@1':h'Authorization'='NTLM TlRMTVNTUAADAAAA'" % self.server.urlbase
+            ).status_code == 200
+            # Even if the following requests do not carry any credentials.
+            assert p.request("get:'%s/p/200:b@1'" % self.server.urlbase).status_code == 200
+            p.close()
+        assert accepted == [False]
+
+        with self.pool_put() as accepted:
+            p = self.pathoc()
+            assert p.request(
+                "get:'%s/p/200:b@1':h'Authorization'='Negotiate YIIGhgYGKwYBBQUCoIIGejCCBnag'" %
+                self.server.urlbase
+            ).status_code == 200
+            p.close()
+        assert accepted == [False]
+        assert len(pool) == 0
+
+        # Basic authentication is per request.
+        with self.pool_put() as accepted:
+            p = self.pathoc()
+            assert p.request(
+                "get:'%s/p/200:b@1':h'Authorization'='Basic Zm9vOmJhcg=='" % self.server.urlbase
+            ).status_code == 200
+            p.close()
+        assert accepted == [True]
+
+
 class TestHTTPAuth(tservers.HTTPProxTest):
     authenticator = http.authentication.BasicProxyAuth(
         http.authentication.PassManSingleUser(
@@ -343,6 +472,30 @@ class TestHTTPS(tservers.HTTPProxTest, CommonMixin, TcpMixin):
         assert p.request("get:/:i0,'invalid\r\n\r\n'").status_code == 400
 
 
+
+class TestTlsSessionCache(tservers.HTTPProxTest):
+    ssl = True
+
+    def test_simple(self):
+        cache = self.config.tls_session_cache
+        cache.clear()
+        handshakes = cache.hits + cache.misses
+        assert self.pathod("304").status_code == 304
+        assert cache.hits + cache.misses == handshakes + 1
+        assert len(cache) == 1
+        assert self.pathod("304").status_code == 304
+        assert cache.hits + cache.misses == handshakes + 2
+        assert len(cache) == 1
+
+    def test_client_contexts(self):
+        cache = self.config.client_tls_context_cache
+        cache.clear()
+        assert self.pathod("304").status_code == 304
+        assert self.pathod("304").status_code == 304
+        assert len(cache) == 1
+        assert cache.hits >= 1
+
+
 class TestHTTPSCertfile(tservers.HTTPProxTest, CommonMixin):
     ssl = True
     certfile = True
@@ -523,6 +676,27 @@ class TestTransparent(tservers.TransparentProxTest, CommonMixin, TcpMixin):
 
         self.master.unload_scripts()
 
+    def test_ignore_stream_modify(self):
+        # Ignored connections are only relayed without looking at the data
+        # if there is no tcp_message hook.
+        self.master.load_script(
+            tutils.test_data.path("scripts/tcp_stream_modify.py"))
+
+        self._ignore_on()
+        d = self.pathod('200:b"foo"')
+        self._ignore_off()
+
+        assert d.content == "bar"
+
+        self.master.unload_scripts()
+
+    def test_ignore_large(self):
+        self._ignore_on()
+        d = self.pathod("200:b@1m")
+        self._ignore_off()
+
+        assert len(d.content) == 1024 ** 2
+
 
 class TestTransparentSSL(tservers.TransparentProxTest, CommonMixin, TcpMixin):
     ssl = True
@@ -4,6 +4,11 @@
 # Requirements:
 # - Apache Bench "ab" binary
 # - pip install click yappi
+#
+# By default, responses are served from 1024example with server replay, which
+# needs every request on the master thread. Use --no-server-replay together
+# with --url pointing to a local server to measure the plain proxy path,
+# where no hooks are subscribed and proxy threads never wait for the master.
 
 from libmproxy.main import mitmdump
 from os import system
@@ -16,24 +21,27 @@ import click
 
 class ApacheBenchThread(Thread):
 
-    def __init__(self, concurrency):
+    def __init__(self, concurrency, url):
         self.concurrency = concurrency
+        self.url = url
         super(ApacheBenchThread, self).__init__()
 
     def run(self):
         time.sleep(2)
         system(
-            "ab -n 1024 -c {} -X 127.0.0.1:8080 http://example.com/".format(self.concurrency))
+            "ab -n 1024 -c {} -X 127.0.0.1:8080 {}".format(self.concurrency, self.url))
 
 
 @click.command()
 @click.option('--profiler', default="none", type=click.Choice(['none', 'yappi']))
 @click.option('--clock-type', default="cpu", type=click.Choice(['wall', 'cpu']))
 @click.option('--concurrency', default=1, type=click.INT)
-def main(profiler, clock_type, concurrency):
+@click.option('--server-replay/--no-server-replay', default=True)
+@click.option('--url', default="http://example.com/")
+def main(profiler, clock_type, concurrency, server_replay, url):
 
     outfile = "callgrind.mitmdump-{}-c{}".format(clock_type, concurrency)
-    a = ApacheBenchThread(concurrency)
+    a = ApacheBenchThread(concurrency, url)
     a.start()
 
     if profiler == "yappi":
@@ -41,7 +49,10 @@ def main(profiler, clock_type, concurrency):
         yappi.start(builtins=True)
 
     print("Start mitmdump...")
-    mitmdump(["-k", "-q", "-S", "1024example"])
+    args = ["-k", "-q"]
+    if server_replay:
+        args.extend(["-S", "1024example"])
+    mitmdump(args)
     print("mitmdump stopped.")
 
     print("Save profile information...")
@@ -0,0 +1,68 @@
+# Measure the memory footprint of many idle keep-alive clients.
+#
+# Start mitmdump (optionally with --event-loop or --thread-stack-size), then run
+#
+#   python idleconns.py --pid $(pgrep -f mitmdump) -n 10000
+#
+# The script opens the given number of connections to the proxy, sends one
+# request on each of them to make sure a connection thread has been spawned,
+# keeps them open and reports the resident memory and thread count of the
+# proxy process. With --event-loop, idle connections are parked after a second
+# and the thread count should stay flat.
+# Linux only (reads /proc/<pid>/status). Make sure "ulimit -n" is high enough.
+from __future__ import print_function
+import socket
+import time
+
+import click
+
+
+def rss(pid):
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+
+def threads(pid):
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+
+
+@click.command()
+@click.option('--pid', type=click.INT, required=True, help="PID of the proxy process")
+@click.option('--proxy', default="127.0.0.1:8080")
+@click.option('--url', default="http://example.com/")
+@click.option('-n', '--connections', default=1000, type=click.INT)
+@click.option('--step', default=1000, type=click.INT, help="Report every STEP connections")
+def main(pid, proxy, url, connections, step):
+    host, port = proxy.rsplit(":", 1)
+    request = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n\r\n".format(
+        url, url.split("/")[2]
+    )
+
+    base = rss(pid)
+    print("Baseline: {:.1f} MiB, {} threads".format(base / 1024.0 ** 2, threads(pid)))
+
+    socks = []
+    for i in range(1, connections + 1):
+        s = socket.create_connection((host, int(port)))
+        s.sendall(request)
+        socks.append(s)
+        if i % step == 0 or i == connections:
+            time.sleep(1)
+            mem = rss(pid)
+            print("{:>6} idle connections: {:.1f} MiB ({:.1f} KiB/connection), {} threads".format(
+                i,
+                mem / 1024.0 ** 2,
+                (mem - base) / 1024.0 / i,
+                threads(pid)
+            ))
+
+    for s in socks:
+        s.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Measure the throughput of relaying raw TCP connections, e.g. for --ignore hosts.
+#
+#   python tcpbench.py --size 1024 --connections 4
+#
+# The script starts a local server that sends SIZE MiB on every connection and a
+# proxy that ignores all hosts, then downloads through the proxy (via CONNECT)
+# and reports the throughput. Use --no-splice to relay through user space even on
+# Linux, and --tcp-message to load a tcp_message hook, which disables the fast path.
+from __future__ import print_function
+import os
+import socket
+import threading
+import time
+
+import click
+
+from libmproxy import flow, platform
+from libmproxy.proxy.config import ProxyConfig
+from libmproxy.proxy.server import ProxyServer
+
+CHUNK = b"x" * 65536
+
+
+class Source(threading.Thread):
+
+    def __init__(self, size):
+        super(Source, self).__init__()
+        self.daemon = True
+        self.size = size
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+
+    def serve(self, conn):
+        conn.recv(1)
+        sent = 0
+        while sent < self.size:
+            sent += conn.send(CHUNK[:self.size - sent])
+        conn.close()
+
+    def run(self):
+        while True:
+            conn, _ = self.sock.accept()
+            threading.Thread(target=self.serve, args=(conn,)).start()
+
+
+class TcpMessageMaster(flow.FlowMaster):
+
+    def handle_tcp_message(self, m):
+        m.reply()
+
+
+def download(proxy_port, port, size):
+    s = socket.create_connection(("127.0.0.1", proxy_port))
+    s.sendall(b"CONNECT 127.0.0.1:%d HTTP/1.1\r\n\r\n" % port)
+    head = b""
+    while b"\r\n\r\n" not in head:
+        head += s.recv(1)
+    assert b" 200 " in head, head
+    # The proxy only decides how to relay the connection once the client has sent something.
+    s.sendall(b"x")
+    received = 0
+    while True:
+        d = s.recv(1024 * 1024)
+        if not d:
+            break
+        received += len(d)
+    s.close()
+    assert received == size, received
+
+
+@click.command()
+@click.option('--size', default=1024, type=click.INT, help="MiB per connection")
+@click.option('-n', '--connections', default=1, type=click.INT, help="Concurrent connections")
+@click.option('--no-splice', is_flag=True)
+@click.option('--tcp-message', is_flag=True, help="Pass every chunk to the master")
+def main(size, connections, no_splice, tcp_message):
+    size *= 1024 * 1024
+    if no_splice:
+        platform.splicer = None
+    source = Source(size)
+    source.start()
+
+    config = ProxyConfig(port=0, ignore_hosts=[".*"])
+    master_class = TcpMessageMaster if tcp_message else flow.FlowMaster
+    master = master_class(ProxyServer(config), flow.State())
+    threading.Thread(target=master.run).start()
+    try:
+        start = time.time()
+        clients = [
+            threading.Thread(target=download, args=(master.server.address.port, source.port, size))
+            for _ in range(connections)
+        ]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        duration = time.time() - start
+    finally:
+        master.shutdown()
+
+    total = size * connections / 1024.0 ** 2
+    print("{} (splice: {}): {:.0f} MiB in {:.2f}s, {:.0f} MiB/s".format(
+        "tcp_message" if tcp_message else "passthrough",
+        bool(platform.splicer) and not tcp_message,
+        total, duration, total / duration
+    ))
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()